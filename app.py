@@ -1,15 +1,14 @@
 import streamlit as st
 import pandas as pd
 import os
+import time
 from dotenv import load_dotenv
-from utils import (
-    get_coordinates_from_address,
-    get_id_cadastre_from_coordinates,
-    get_dpe_exact_address,
-    get_dpe_exact_coordinates,
-    normalize_address,
-    highlight_used_fields
-)
+from metrics import metrics, start_metrics_server
+from fiche_bien import FicheBien
+from utils import filter_dvf_by_surface, highlight_used_fields
+from pipeline import enrich_address
+from prefetch import Prefetcher
+from store import get_dvf_store
 
 # --- Charger la clé ADEME ---
 load_dotenv()
@@ -19,35 +18,191 @@ if not ADEME_TOKEN:
     st.error("⚠️ Clé ADEME introuvable. Ajoutez-la dans .env ou dans les secrets Streamlit.")
     st.stop()
 
+# Export Prometheus des compteurs si METRICS_PORT est défini (une fois par process)
+start_metrics_server()
+
+# Durée de conservation d'un enrichissement incomplet (source en erreur ou hors délai, en secondes) :
+# passé ce délai, la prochaine relance de la page refait les appels
+ENRICHISSEMENT_ERREUR_TTL = 30
+
+
+def enrichir(adresse):
+    """
+    Résultats de enrich_address (géocodage, DPE, DVF) pour l'adresse saisie,
+    calculés une seule fois par session : un changement de sélection ne relance pas les appels.
+    Un résultat avec des erreurs n'est gardé que ENRICHISSEMENT_ERREUR_TTL secondes.
+    """
+    memo = st.session_state.get("enrichissement")
+    if memo is None or memo["adresse"] != adresse or time.monotonic() > memo["expiration"]:
+        # suggestion déjà enrichie pendant la saisie, sinon enrichissement complet
+        resultats = anticipation().result(adresse) or enrich_address(adresse, ADEME_TOKEN)
+        anticipation().cancel()
+        expiration = time.monotonic() + ENRICHISSEMENT_ERREUR_TTL if resultats["errors"] else float("inf")
+        memo = {"adresse": adresse, "resultats": resultats, "expiration": expiration, "fiches": {}}
+        st.session_state["enrichissement"] = memo
+    return memo["resultats"]
+
+
+def anticipation():
+    """
+    Enrichissement anticipé des suggestions BAN de la session (créé au premier appel).
+    """
+    if "anticipation" not in st.session_state:
+        st.session_state["anticipation"] = Prefetcher(ADEME_TOKEN)
+    return st.session_state["anticipation"]
+
+
+def valider(adresse):
+    st.session_state["adresse"] = adresse.strip()
+
+
+@st.fragment
+def saisie_adresse():
+    """
+    Saisie de l'adresse. Pendant la frappe, seul ce bloc est relancé (après 300 ms de pause) :
+    les suggestions BAN s'affichent et les premières sont enrichies en arrière-plan.
+    Choisir une suggestion ou cliquer sur Rechercher valide l'adresse et relance la page.
+    """
+    saisie = st.text_input("Entrez une adresse :", key="saisie", live="300ms")
+    suggestions = anticipation().update(saisie) if saisie else []
+    for i, suggestion in enumerate(suggestions):
+        if st.button(suggestion["adresse_label"], key=f"suggestion_{i}"):
+            valider(suggestion["adresse_label"])
+            st.rerun()
+    if st.button("Rechercher", type="primary", disabled=not saisie.strip()):
+        valider(saisie)
+        st.rerun()
+
+
+def fiche(adresse, df_dvf, dpe_coordinates, choix_surface, choix_dpe, timings):
+    """
+    Mutations DVF retenues et FicheBien pour une sélection (surface, numéro de DPE),
+    mémorisées pour l'adresse en cours.
+    """
+    fiches = st.session_state["enrichissement"]["fiches"]
+    cle = (choix_surface, choix_dpe)
+    if cle not in fiches:
+        # 5. Sélectionner un DVF
+        with metrics.stage("selection_dvf", timings):
+            if len(df_dvf) > 1 and choix_surface is not None:
+                # Tolérance de 5 %
+                df_dvf = filter_dvf_by_surface(df_dvf, choix_surface, tolerance=0.05)
+
+        # 6. Construire la fiche avec DVF + DPE
+        with metrics.stage("fiche", timings):
+            fiches[cle] = (df_dvf, FicheBien.from_frames(df_dvf, dpe_coordinates))
+    return fiches[cle]
+
+
+def marche(coords, df_dvf, surface=None):
+    """
+    Dernière mutation et surfaces connues de l'adresse DVF, prix médians au m² de la voie
+    et de la commune (tables agrégées : aucune lecture de la table DVF), puis ventes
+    comparables du code postal à +/- 5 % de `surface` (index des surfaces).
+    """
+    dvf_store = get_dvf_store()
+    code_commune = coords.get("code_insee")
+    voie = None
+    if not df_dvf.empty:
+        resume = dvf_store.resume_adresse(df_dvf["adresse_complete"].iloc[0])
+        if resume is not None:
+            st.write(
+                f"**Dernière mutation** : {resume['date_mutation_derniere_mutation']}, "
+                f"{resume['type_local_derniere_mutation']} de {resume['surface_reelle_bati_derniere_mutation']} m² "
+                f"pour {resume['valeur_fonciere_derniere_mutation']:,.0f} € "
+                f"({resume['nb_mutations']} mutation(s) à cette adresse)"
+            )
+            st.write(f"**Surfaces connues** : {', '.join(f'{surface} m²' for surface in resume['surfaces'])}")
+        code_commune = str(df_dvf["code_commune"].iloc[0])
+        voie = df_dvf["adresse_nom_voie"].iloc[0]
+
+    type_local = st.radio("Type de local", ["Tous", "Maison", "Appartement"], horizontal=True)
+    for titre, prix in (("Voie", dvf_store.prix_m2(code_commune, voie, type_local) if voie else None),
+                        ("Commune", dvf_store.prix_m2(code_commune, type_local=type_local))):
+        if prix is None:
+            continue
+        st.write(f"**Prix médian au m² — {titre}**")
+        if prix.empty:
+            st.info("Aucune vente sur les périodes calculées.")
+        else:
+            st.dataframe(prix.rename(columns={
+                "periode_mois": "période (mois)", "prix_m2_median": "prix médian (€/m²)", "nb_mutations": "ventes"
+            }))
+
+    code_postal = coords.get("code_postal")
+    if surface is not None and code_postal:
+        comparables = dvf_store.lookup_surface(
+            surface, tolerance=0.05, code_postal=code_postal,
+            type_local=None if type_local == "Tous" else type_local
+        )
+        st.write(f"**Ventes comparables** ({surface} m² à +/- 5 %, code postal {code_postal}) : {len(comparables)}")
+        if not comparables.empty:
+            prix_m2 = comparables["valeur_fonciere"] / comparables["surface_reelle_bati"].astype(float)
+            st.write(f"Prix médian : {prix_m2.median():,.0f} €/m²")
+            st.dataframe(comparables.sort_values("date_mutation", ascending=False).head(20)[
+                ["date_mutation", "adresse_complete", "type_local", "surface_reelle_bati", "valeur_fonciere"]
+            ])
+
+
+def panneau_debug(timings):
+    """
+    Durées des étapes pour l'adresse en cours, puis compteurs du process
+    (étapes, API externes, caches) et leur export Prometheus.
+    """
+    with st.expander("⏱️ Instrumentation", expanded=True):
+        st.write("**Étapes de cette adresse** (l'enrichissement est calculé une fois par adresse)")
+        st.dataframe(pd.DataFrame(
+            [{"étape": etape, "durée (ms)": round(duree * 1000, 1)} for etape, duree in timings.items()]
+        ))
+        snapshot = metrics.snapshot()
+        st.write("**Étapes (process)**")
+        st.dataframe(pd.DataFrame.from_dict(snapshot["stages"], orient="index"))
+        st.write("**API externes (process)**")
+        st.dataframe(pd.DataFrame.from_dict(snapshot["apis"], orient="index"))
+        st.write("**Caches (process)**")
+        st.dataframe(pd.DataFrame.from_dict(snapshot["caches"], orient="index"))
+        st.download_button("Exporter (Prometheus)", metrics.prometheus_text(), file_name="metrics.prom")
+
+
 # --- Titre de l'app ---
 st.title("Enrichissement automatique fiches de bien")
 st.write("Remarque: pour ce POC, seules les recherches dans le Finistère sont possibles.")
+debug = st.sidebar.checkbox("Afficher l'instrumentation (temps, API, caches)")
 
 # --- Saisie de l'adresse ---
-adresse_input = st.text_input("Entrez une adresse :")
+saisie_adresse()
+adresse_input = st.session_state.get("adresse")
 
 if adresse_input:
-    # 1. Géocodage via BAN
-    coords = get_coordinates_from_address(adresse_input)
+    # 1. Géocodage via BAN, puis 2. DPE par coordonnées et 3. DVF en parallèle
+    resultats = enrichir(adresse_input)
+    coords = resultats["coords"]
     if "error" in coords:
         st.error(f"Erreur géocodage : {coords['error']}")
         st.stop()
 
-    # 2. DPE par coordonnées
-    dpe_coordinates = get_dpe_exact_coordinates(coords["coord_geo_x"], coords["coord_geo_y"], ADEME_TOKEN)
+    timings = dict(resultats["timings"])
+
+    for source, erreur in resultats["errors"].items():
+        st.warning(f"Source {source} indisponible : {erreur}")
+
+    dpe_coordinates = resultats["dpe"]
 
     if dpe_coordinates.empty:
         st.warning("Aucun DPE trouvé pour ces coordonnées.")
 
-    # 3. DVF
-    df = pd.read_csv("dvf_ok.csv")
-    adresse_clean = normalize_address(coords["adresse_label"])
-    df_dvf = df.loc[
-        df['adresse_complete'] == adresse_clean
-    ]
+    df_dvf = resultats["dvf"]
+    if "parcelle_ban" in df_dvf.columns and not df_dvf.empty:
+        st.info(f"Adresse absente des DVF : mutations de la parcelle {df_dvf['parcelle_ban'].iloc[0]}.")
+    elif "score_adresse" in df_dvf.columns and not df_dvf.empty:
+        st.info(f"Adresse DVF approchée : {df_dvf['adresse_complete'].iloc[0]} (score {df_dvf['score_adresse'].iloc[0]:.2f}).")
+    elif "distance_m" in df_dvf.columns and not df_dvf.empty:
+        st.info("Adresse absente des DVF : mutations situées à proximité du point BAN.")
 
     # 4. Sélectionner un DPE
-    
+
+    choix_surface = None
+    choix_dpe = None
     if len(dpe_coordinates) > 1:
         st.write("Plusieurs DPE trouvés, veuillez affiner votre recherche :")
 
@@ -66,70 +221,26 @@ if adresse_input:
             )
             dpe_coordinates = dpe_coordinates[dpe_coordinates['numero_dpe'] == choix_dpe]
             
-    # 5. Sélectionner un DVF
-    
-    if len(df_dvf) > 1:
-        # Tolérance de 5 %
-        tolerance = 0.05
-
-        # Bornes min et max
-        min_surface = choix_surface * (1 - tolerance)
-        max_surface = choix_surface * (1 + tolerance)
-
-        # Filtrage
-        df_dvf = df_dvf[
-            (df_dvf['surface_reelle_bati'] >= min_surface) &
-            (df_dvf['surface_reelle_bati'] <= max_surface)
-        ]
-
-    # 6. Construire final_data avec DVF + DPE
-    final_data = {}
-
-    # Champs DVF
-    for col in ['surface_reelle_bati', 'nombre_pieces_principales', 'surface_terrain']:
-        unique_vals = df_dvf[col].dropna().unique()
-        if len(unique_vals) == 1:
-            final_data[col] = {"valeur": unique_vals[0], "source": "DVF"}
-        elif len(unique_vals) > 1:
-            final_data[col] = {"valeur": unique_vals.tolist(), "source": "DVF"}
-        else:
-            final_data[col] = {"valeur": None, "source": "DVF"}
-
-    # Champs DPE
-    for col in ['numero_dpe','adresse_ban','etiquette_dpe','date_etablissement_dpe','date_derniere_modification_dpe','etiquette_ges','conso_5 usages_par_m2_ef','conso_5_usages_par_m2_ep','emission_ges_5_usages par_m2','annee_construction','type_batiment','nombre_niveau_logement','complement_adresse_logement','surface_habitable_logement','type_installation_chauffage']:
-        unique_vals = dpe_coordinates[col].dropna().unique()
-        if len(unique_vals) == 1:
-            final_data[col] = {"valeur": unique_vals[0], "source": "DPE"}
-        elif len(unique_vals) > 1:
-            final_data[col] = {"valeur": unique_vals.tolist(), "source": "DPE"}
-        else:
-            final_data[col] = {"valeur": None, "source": "DPE"}
+    # 5. et 6. DVF retenus et fiche de bien, recalculés seulement quand la sélection change
+    df_dvf, fiche_bien = fiche(adresse_input, df_dvf, dpe_coordinates, choix_surface, choix_dpe, timings)
 
-    # 7. Transformer en DataFrame vertical
-    df_final = pd.DataFrame([
-        {"champ à remplir": champ, "valeur": data["valeur"], "source de donnée": data["source"]}
-        for champ, data in final_data.items()
-    ])
+    debut_affichage = time.perf_counter()
 
-    # 8. Affichage interactif
+    # 7. et 8. Affichage interactif : choix parmi les valeurs candidates
     st.subheader("🎯 Résultats à compléter")
-    for idx, row in df_final.iterrows():
-        champ = row["champ à remplir"]
-        valeur = row["valeur"]
-        source = row["source de donnée"]
-
-        if isinstance(valeur, list):
-            choix = st.selectbox(f"{champ} ({source})", options=valeur)
-            df_final.at[idx, "valeur"] = choix
+    for champ in fiche_bien:
+        if champ.a_choisir:
+            choix = st.selectbox(f"{champ.nom} ({champ.source})", options=champ.candidats)
+            fiche_bien.choisir(champ.nom, choix)
         else:
-            st.write(f"**{champ} ({source})** : {valeur}")
+            st.write(f"**{champ.nom} ({champ.source})** : {champ.valeur}")
 
     # 9. Afficher le tableau final
-    tab1, tab2, tab3 = st.tabs(["✅ Données finales", "📊 Données DVF", "📄 Données DPE"])
+    tab1, tab2, tab3, tab4 = st.tabs(["✅ Données finales", "📊 Données DVF", "📄 Données DPE", "📈 Marché"])
 
     with tab1:
         st.subheader("✅ Données finales")
-        st.dataframe(df_final)
+        st.dataframe(fiche_bien.to_frame())
 
     with tab2:
         st.subheader("📄 Données DVF")
@@ -137,7 +248,7 @@ if adresse_input:
             st.warning("Aucune donnée DPE trouvée pour ces coordonnées.")
         else:
             # 1️⃣ Liste des champs utilisés dans df_final avec source DPE
-            champs_utilises_dvf = df_final.loc[df_final["source de donnée"] == "DVF", "champ à remplir"].tolist()
+            champs_utilises_dvf = fiche_bien.champs_source("DVF")
 
             # 2️⃣ Transformer dpe_coordinates en format vertical
             df_dvf_display = df_dvf.transpose().reset_index()
@@ -161,7 +272,7 @@ if adresse_input:
             st.warning("Aucune donnée DPE trouvée pour ces coordonnées.")
         else:
             # 1️⃣ Liste des champs utilisés dans df_final avec source DPE
-            champs_utilises_dpe = df_final.loc[df_final["source de donnée"] == "DPE", "champ à remplir"].tolist()
+            champs_utilises_dpe = fiche_bien.champs_source("DPE")
 
             # 2️⃣ Transformer dpe_coordinates en format vertical
             df_dpe_display = dpe_coordinates.transpose().reset_index()
@@ -177,4 +288,17 @@ if adresse_input:
                     lambda row: highlight_used_fields(row, champs_utilises_dpe),
                     axis=1
                 )
-            )
\ No newline at end of file
+            )
+
+    with tab4:
+        st.subheader("📈 Marché")
+        # surface choisie, ou celle du DPE s'il n'y en a qu'une
+        surfaces_dpe = fiche_bien["surface_habitable_logement"].candidats
+        if choix_surface is None and len(surfaces_dpe) == 1:
+            choix_surface = surfaces_dpe[0]
+        marche(coords, df_dvf, choix_surface)
+
+    timings["affichage"] = time.perf_counter() - debut_affichage
+    metrics.record_stage("affichage", timings["affichage"])
+    if debug:
+        panneau_debug(timings)
@@ -0,0 +1,153 @@
+"""
+Enrichissement en masse : une fiche de bien par adresse d'un fichier CSV,
+avec le même enchaînement que app.py (géocodage -> DPE -> DVF -> FicheBien).
+
+    python batch.py adresses.csv fiches.csv --column adresse --workers 16
+
+Les fiches sont écrites au fil de l'eau ; relancer la même commande reprend
+là où le traitement s'est arrêté et refait les adresses écrites avec une erreur.
+"""
+import argparse
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from fiche_bien import FicheBien, valeurs_distinctes
+from metrics import metrics
+from pipeline import enrich_address
+from utils import (
+    BAN_CSV_CHUNK_SIZE,
+    DPE_FIELDS,
+    DVF_FIELDS,
+    filter_dvf_by_surface,
+    get_coordinates_bulk
+)
+
+
+COORDS_COLUMNS = ['adresse_label', 'latitude', 'longitude', 'code_insee', 'code_postal', 'coord_geo_x', 'coord_geo_y']
+OUTPUT_COLUMNS = (
+    ['ligne', 'adresse_saisie']
+    + COORDS_COLUMNS
+    + [col for champ in DVF_FIELDS + DPE_FIELDS for col in (champ, f"{champ} (source de donnée)")]
+    + ['erreurs']
+)
+
+# Seule erreur qui ne justifie pas de refaire la ligne à la reprise
+ERREUR_DEFINITIVE = "geocodage : Adresse introuvable"
+
+
+def enrich_row(ligne, adresse, token, coords=None):
+    """
+    Fiche de bien d'une adresse, à plat : valeur et source de donnée de chaque champ.
+    Sans choix possible, plusieurs valeurs candidates sont écrites en liste JSON.
+    `coords` est le géocodage en masse de l'adresse, s'il a abouti.
+    """
+    row = {'ligne': ligne, 'adresse_saisie': adresse}
+    resultats = enrich_address(adresse, token, coords=coords)
+    coords = resultats["coords"]
+    if "error" in coords:
+        row['erreurs'] = f"geocodage : {coords['error']}"
+        return row
+    row.update({col: coords.get(col) for col in COORDS_COLUMNS})
+
+    dpe = resultats["dpe"]
+    df_dvf = resultats["dvf"]
+    # un seul DPE : sa surface sert à choisir les mutations DVF, comme dans l'app
+    surfaces = valeurs_distinctes(dpe, 'surface_habitable_logement')
+    if len(df_dvf) > 1 and len(surfaces) == 1:
+        df_dvf = filter_dvf_by_surface(df_dvf, surfaces[0], tolerance=0.05)
+
+    row.update(FicheBien.from_frames(df_dvf, dpe).to_row())
+    row['erreurs'] = "; ".join(f"{source} : {erreur}" for source, erreur in resultats["errors"].items()) or None
+    return row
+
+
+def _resume(output_path):
+    """
+    Lignes déjà traitées de `output_path` : celles sans erreur, ou dont l'adresse est
+    introuvable (réponse définitive de la BAN). Les lignes en erreur sont retirées
+    du fichier pour être refaites.
+    """
+    existing = pd.read_csv(output_path, dtype=str, keep_default_na=False)
+    ok = (existing['erreurs'] == '') | (existing['erreurs'] == ERREUR_DEFINITIVE)
+    if not ok.all():
+        # réécriture complète puis remplacement : le fichier reste lisible en cas d'arrêt
+        tmp = f"{output_path}.tmp"
+        existing[ok].to_csv(tmp, index=False)
+        os.replace(tmp, output_path)
+    return set(existing.loc[ok, 'ligne'].astype(int))
+
+
+def run_batch(input_path, output_path, token, column='adresse', workers=16):
+    """
+    Enrichit toutes les adresses de `input_path` (colonne `column`) avec au plus
+    `workers` adresses en cours à la fois ; le débit par API est borné par le client HTTP.
+    Les lignes déjà présentes sans erreur dans `output_path` sont sautées ;
+    celles écrites avec une erreur (API indisponible, délai dépassé) sont refaites.
+    Renvoie le nombre de fiches écrites.
+    """
+    adresses = pd.read_csv(input_path, usecols=[column], dtype=str)[column]
+    done = set()
+    if os.path.exists(output_path):
+        done = _resume(output_path)
+    todo = ((ligne, adresse) for ligne, adresse in adresses.items() if ligne not in done and pd.notna(adresse))
+
+    written = 0
+    header = not os.path.exists(output_path)
+
+    def write(rows):
+        nonlocal header, written
+        pd.DataFrame(rows, columns=OUTPUT_COLUMNS).to_csv(output_path, mode='a', header=header, index=False)
+        header = False
+        written += len(rows)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            block = list(islice(todo, BAN_CSV_CHUNK_SIZE))
+            if not block:
+                break
+            # géocodage du bloc en une seule requête BAN, transmis à chaque fiche ;
+            # une adresse en erreur est regéocodée seule par enrich_address
+            geocodes = {
+                adresse: coords for adresse, coords in get_coordinates_bulk([adresse for _, adresse in block])
+                if "error" not in coords
+            }
+            for ligne, adresse in block:
+                pending.add(pool.submit(enrich_row, ligne, adresse, token, geocodes.get(adresse)))
+                # fenêtre glissante : quelques adresses d'avance seulement
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    write([future.result() for future in finished])
+        if pending:
+            finished, _ = wait(pending)
+            write([future.result() for future in finished])
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrichissement en masse des fiches de bien.")
+    parser.add_argument("input", help="CSV des adresses à enrichir")
+    parser.add_argument("output", help="CSV des fiches (complété s'il existe déjà)")
+    parser.add_argument("--column", default="adresse", help="colonne des adresses dans le fichier d'entrée")
+    parser.add_argument("--workers", type=int, default=16, help="nombre d'adresses traitées en parallèle")
+    parser.add_argument("--metrics", help="fichier où écrire les compteurs (format Prometheus) en fin de traitement")
+    args = parser.parse_args()
+
+    load_dotenv()
+    token = os.getenv("ADEME_TOKEN")
+    if not token:
+        parser.error("Clé ADEME introuvable. Ajoutez-la dans .env ou dans la variable ADEME_TOKEN.")
+
+    written = run_batch(args.input, args.output, token, column=args.column, workers=args.workers)
+    print(f"{written} fiches écrites dans {args.output}")
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(metrics.prometheus_text())
+
+
+if __name__ == "__main__":
+    main()
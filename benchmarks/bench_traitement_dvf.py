@@ -0,0 +1,105 @@
+"""
+Benchmark de traitement_dvf sur un DVF synthétique : débit (lignes/seconde)
+de la version d'origine ligne à ligne (df.apply, recopiée telle quelle) et de la version
+vectorisée actuelle. La version actuelle fait plus de travail (abréviations, espaces) :
+l'écart mesuré est celui du code livré, pas d'un traitement identique.
+
+    python benchmarks/bench_traitement_dvf.py --rows 200000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils import traitement_dvf  # noqa: E402
+from benchmarks.synthetic_dvf import make_synthetic_dvf  # noqa: E402
+
+
+# Version de référence : code de utils.py avant la vectorisation, recopié tel quel
+# (seuls les noms changent), pour mesurer l'ancien chemin et non un mélange des deux
+
+def convert_to_int_baseline(df):
+    df['adresse_numero'] = pd.to_numeric(df['adresse_numero'], errors='coerce').astype('Int64')
+    df['code_postal'] = pd.to_numeric(df['code_postal'], errors='coerce').astype('Int64')
+    df['code_type_local'] = pd.to_numeric(df['code_type_local'], errors='coerce').astype('Int64')
+    df['surface_reelle_bati'] = pd.to_numeric(df['surface_reelle_bati'], errors='coerce').astype('Int64')
+    df['nombre_pieces_principales'] = pd.to_numeric(df['nombre_pieces_principales'], errors='coerce').astype('Int64')
+    df['surface_terrain'] = pd.to_numeric(df['surface_terrain'], errors='coerce').astype('Int64')
+    return df
+
+def normalize_address_baseline(adr):
+    # Supprimer les accents
+    nfkd_form = unicodedata.normalize('NFKD', adr)
+    without_accents = "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+    # Supprimer les caractères spéciaux
+    clean = re.sub(r'[^A-Za-z0-9\s]', '', without_accents)
+    # Mettre en majuscules
+    return clean.upper().strip()
+
+def create_adresse_complete_baseline(df):
+    # Nettoyage des NaN
+    df[['adresse_suffixe', 'adresse_nom_voie', 'code_postal', 'nom_commune']] = \
+        df[['adresse_suffixe', 'adresse_nom_voie', 'code_postal', 'nom_commune']].fillna('')
+
+    # Création sans doubles espaces
+    df['adresse_complete'] = df.apply(
+        lambda row: " ".join(
+            str(x) for x in [
+                row['adresse_numero'],
+                row['adresse_suffixe'],
+                row['adresse_nom_voie'] + ",",
+                str(row['code_postal']),
+                row['nom_commune'].upper()
+            ] if str(x).strip()
+        ),
+        axis=1
+    )
+
+    # Normalisation finale
+    df["adresse_complete"] = df["adresse_complete"].apply(normalize_address_baseline)
+    
+    return df
+
+def traitement_dvf_baseline(df):
+    #je supprime les lignes où les valeurs sont égales au nom de la colonne
+    mask = df.apply(lambda row: any(row[col] == col for col in df.columns), axis=1)
+    df = df[~mask]
+    #je ne garde que les appartements et les maisons
+    df = df.loc[(df['code_type_local'] == 1) | (df['code_type_local'] == 2)]
+    df = convert_to_int_baseline(df)
+    df = create_adresse_complete_baseline(df)
+    df.drop_duplicates(subset=['adresse_complete', 'id_parcelle', 'type_local', 'date_mutation', 'longitude', 'latitude'], inplace=True)
+    return df
+
+
+def mesurer(fonction, df):
+    debut = time.perf_counter()
+    resultat = fonction(df.copy())
+    duree = time.perf_counter() - debut
+    return resultat, duree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="nombre de lignes du DVF synthétique")
+    args = parser.parse_args()
+
+    df = make_synthetic_dvf(args.rows)
+    print(f"DVF synthétique : {len(df)} lignes")
+
+    avant, duree_avant = mesurer(traitement_dvf_baseline, df)
+    apres, duree_apres = mesurer(traitement_dvf, df)
+
+    print(f"avant (origine)       : {len(df) / duree_avant:>12,.0f} lignes/s ({duree_avant:.2f} s)")
+    print(f"après (vectorisé)     : {len(df) / duree_apres:>12,.0f} lignes/s ({duree_apres:.2f} s)")
+    print(f"accélération          : x{duree_avant / duree_apres:.1f}")
+    print(f"lignes en sortie      : {len(avant)} / {len(apres)}")
+
+
+if __name__ == "__main__":
+    main()
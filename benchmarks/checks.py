@@ -0,0 +1,381 @@
+"""
+Vérifications de correction, sans réseau : les API sont rejouées par benchmarks/mock_server.py
+et le DVF est synthétique. Chaque vérification échoue sur une assertion.
+
+    python benchmarks/checks.py
+
+Vérifications :
+- fixtures : les réponses reconstituées sont cohérentes entre elles (x/y Lambert-93
+  de la BAN et des DPE, parcelles sous le point BAN) ;
+- normalisation_adresses : un libellé BAN (traits d'union) et le libellé DVF abrégé de la même
+  adresse donnent la même clé, sans développer les mots hors de la place du type de voie ;
+- jointure_parcelle : une adresse absente du DVF retrouve ses mutations par la parcelle
+  du géocodage inverse (identifiant au format DVF) ;
+- surfaces_departement : la recherche par surface sur un département retient les codes postaux
+  qui commencent par son numéro ("29", "974"), y compris pour la Corse ("2A", "2B") ;
+- index_etendus : après traitement_dvf_incremental, les index étendus (grille, parcelles,
+  surfaces, trigrammes) sont identiques à ceux reconstruits sur la table complète ;
+- colonnes_mappees : MappedDVFStore renvoie les mêmes résultats que DVFStore ;
+- versions_mappees : la dernière version des colonnes mappées reste servie pendant
+  la réécriture de la table, remplace la table en mémoire et est remplacée d'un bloc ;
+- resume_adresses : les surfaces du résumé par adresse sont celles de l'adresse,
+  y compris quand des lignes n'ont pas d'identifiant de mutation ;
+- anticipation_debit : les requêtes spéculatives, jusque dans les threads du pipeline,
+  n'attendent jamais un jeton du débit partagé d'une API ;
+- geocodage_masse : un second géocodage en masse des mêmes adresses ne refait aucune
+  requête, sans que les x/y recalculés entrent dans le cache du géocodage unitaire ;
+- dpe_flux : les octets des réponses DPE lues en streaming sont comptés, et une réponse
+  coupée en cours de lecture est une erreur de la source, pas une exception.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# caches en mémoire : les vérifications ne touchent jamais au cache.sqlite de l'app
+os.environ["CACHE_PATH"] = ":memory:"
+# pas d'index DPE local : les DPE passent par l'API rejouée
+os.environ["DPE_PATH"] = os.path.join(tempfile.gettempdir(), "checks_sans_index_dpe.parquet")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import store  # noqa: E402
+from benchmarks.mock_server import FIXTURES, HOSTS, MockAPIServer, install_mock  # noqa: E402
+from benchmarks.synthetic_dvf import make_synthetic_dvf, write_synthetic_dvf  # noqa: E402
+from dvf_aggregates import build_adresses  # noqa: E402
+from dvf_mmap import MappedAggregates, dvf_mmap_path, is_dvf_mmap_fresh, write_dvf_mmap  # noqa: E402
+from fuzzy_index import FuzzyAddressIndex  # noqa: E402
+from http_client import HTTPClient, LocalStubAdapter, get_client, set_client, speculative  # noqa: E402
+from metrics import metrics  # noqa: E402
+from key_index import KeyIndex  # noqa: E402
+from pipeline import enrich_address, get_dvf_from_coordinates  # noqa: E402
+from spatial_index import SpatialGrid, lonlat_to_lambert93  # noqa: E402
+from surface_index import SurfaceIndex  # noqa: E402
+from utils import (  # noqa: E402
+    export_dvf,
+    geocode_cache,
+    geocode_cache_key,
+    get_coordinates_bulk,
+    get_coordinates_from_address,
+    get_dpe_exact_coordinates,
+    get_id_cadastre_from_coordinates,
+    normalize_address,
+    normalize_address_series,
+    traitement_dvf,
+    traitement_dvf_incremental,
+    traitement_dvf_streaming
+)
+
+
+# Parcelle du géocodage inverse reconstitué (benchmarks/fixtures/geopf_reverse.json), au format DVF
+PARCELLE_FIXTURE = "29019000BK0214"
+
+# Écart toléré entre les x/y Lambert-93 des réponses et ceux recalculés depuis longitude/latitude (mètres)
+FIXTURE_XY_TOLERANCE = 1.0
+
+# Distance maximale entre le point BAN et la parcelle la plus proche du géocodage inverse (mètres)
+FIXTURE_PARCEL_DISTANCE = 30.0
+
+CHECKS = []
+
+
+def check(function):
+    CHECKS.append(function)
+    return function
+
+
+def synthetic_table(workdir, n_rows=2_000, seed=0):
+    """
+    Table DVF nettoyée écrite dans `workdir`, dont la première mutation est sur PARCELLE_FIXTURE.
+    Renvoie le chemin de la table.
+    """
+    raw = make_synthetic_dvf(n_rows, seed=seed)
+    raw.loc[0, ["id_mutation", "id_parcelle", "adresse_nom_voie", "code_type_local", "type_local"]] = [
+        "2023-parcelle", PARCELLE_FIXTURE, "RUE DU CADASTRE", 1, "Maison"
+    ]
+    path = os.path.join(workdir, f"dvf_{seed}.parquet")
+    export_dvf(traitement_dvf(raw), path)
+    return path
+
+
+def assert_same_arrays(expected, actual, names):
+    for name in names:
+        a, b = np.asarray(getattr(expected, name)), np.asarray(getattr(actual, name))
+        assert a.shape == b.shape and np.array_equal(a, b, equal_nan=a.dtype.kind == "f"), \
+            f"{type(expected).__name__}.{name} diffère"
+
+
+def assert_same_frames(expected, actual, what):
+    expected = expected.reset_index(drop=True)
+    actual = actual.reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_categorical=False, obj=what)
+
+
+@check
+def fixtures(workdir):
+    with open(os.path.join(FIXTURES, "ban_search.json"), encoding="utf-8") as f:
+        ban = json.load(f)["features"][0]
+    lon, lat = ban["geometry"]["coordinates"]
+    x, y = lonlat_to_lambert93(lon, lat)
+    assert np.hypot(x - ban["properties"]["x"], y - ban["properties"]["y"]) <= FIXTURE_XY_TOLERANCE, \
+        f"BAN : x/y {ban['properties']['x']}, {ban['properties']['y']} au lieu de {x:.2f}, {y:.2f}"
+
+    dpe = pd.read_csv(os.path.join(FIXTURES, "dpe03existant.csv"))
+    distance = np.hypot(dpe["coordonnee_cartographique_x_ban"] - x, dpe["coordonnee_cartographique_y_ban"] - y)
+    assert (distance <= FIXTURE_XY_TOLERANCE).all(), f"DPE à {distance.max():.0f} m du point BAN"
+
+    with open(os.path.join(FIXTURES, "geopf_reverse.json"), encoding="utf-8") as f:
+        parcelles = json.load(f)["features"]
+    px, py = lonlat_to_lambert93(*np.array([p["geometry"]["coordinates"] for p in parcelles]).T)
+    assert np.hypot(px - x, py - y).min() <= FIXTURE_PARCEL_DISTANCE, "parcelles loin du point BAN"
+
+
+@check
+def normalisation_adresses(workdir):
+    # libellé BAN (traits d'union, mots complets) -> libellé DVF abrégé -> attendu
+    paires = [
+        ("12 Rue Saint-Jean 29200 Brest", "12 RUE ST JEAN 29200 BREST", "12 RUE SAINT JEAN 29200 BREST"),
+        ("4 bis Avenue du Général-Leclerc 29200 Brest", "4 B AV DU GAL LECLERC 29200 BREST",
+         "4 B AVENUE DU GENERAL LECLERC 29200 BREST"),
+        ("7 Place de l'Église 29200 Brest", "7 PL DE L EGLISE 29200 BREST", "7 PLACE DE L EGLISE 29200 BREST"),
+    ]
+    # mots ordinaires hors de la position du type de voie : inchangés
+    inchanges = ["3 PAS DE LA MAIRIE", "LOT 4 RUE X", "12 RUE DU PL 29200 BREST"]
+    for ban, dvf, attendu in paires:
+        assert normalize_address(ban) == normalize_address(dvf) == attendu, \
+            (normalize_address(ban), normalize_address(dvf))
+    for adresse in inchanges:
+        assert normalize_address(adresse) == adresse, normalize_address(adresse)
+    libelles = [libelle for paire in paires for libelle in paire[:2]] + inchanges
+    serie = normalize_address_series(pd.Series(libelles, dtype="string")).tolist()
+    assert serie == [normalize_address(libelle) for libelle in libelles], serie
+
+
+@check
+def jointure_parcelle(workdir):
+    store.DVF_PATH = synthetic_table(workdir)
+    coords = get_coordinates_from_address("1 impasse absente du dvf 29200 Brest")
+    assert "error" not in coords, coords
+    assert store.get_dvf_store().lookup_adresse(coords["adresse_label"]).empty
+
+    parcelles = get_id_cadastre_from_coordinates(coords["longitude"], coords["latitude"])["id_parcelles"]
+    assert parcelles[0] == PARCELLE_FIXTURE, parcelles
+    df_dvf = get_dvf_from_coordinates(coords, parcelles)
+    assert not df_dvf.empty, "aucune mutation trouvée par la parcelle"
+    assert (df_dvf["parcelle_ban"] == PARCELLE_FIXTURE).all()
+    assert "2023-parcelle" in set(df_dvf["id_mutation"]), df_dvf["id_mutation"].tolist()
+
+
+@check
+def surfaces_departement(workdir):
+    codes = [1000, 20000, 20167, 20200, 20600, 29200, 97100, 97400, 97411]
+    index = SurfaceIndex.build(codes, [1] * len(codes), [80] * len(codes))
+    attendus = {"29": [29200], "01": [1000], 1: [1000], "2A": [20000, 20167], "2b": [20200, 20600],
+                "974": [97400, 97411], "97": [97100, 97400, 97411], "75": []}
+    for departement, codes_postaux in attendus.items():
+        positions = index.around(80, departement=departement)
+        assert sorted(codes[p] for p in positions) == codes_postaux, (departement, positions)
+
+
+@check
+def index_etendus(workdir):
+    n_rows = 20_000
+    path = os.path.join(workdir, "dvf_incremental.parquet")
+    traitement_dvf_streaming(write_synthetic_dvf(os.path.join(workdir, "brut_1.csv"), n_rows, seed=1), path)
+    dvf_store = store.DVFStore(path)
+    # index construits et rangés à côté de la table, puis étendus par l'ajout
+    dvf_store.spatial_grid(), dvf_store.parcel_index(), dvf_store.surface_index(), dvf_store.fuzzy_index()
+    nouveau = make_synthetic_dvf(n_rows // 4, seed=2, n_voies=n_rows // 200, offset=n_rows)
+    nouveau.to_csv(os.path.join(workdir, "brut_2.csv"), index=False)
+    assert traitement_dvf_incremental(os.path.join(workdir, "brut_2.csv"), path) > 0
+
+    df = store.read_table(path, store.DVF_COLUMNS)
+    lon = df["longitude"].to_numpy(dtype=float, na_value=np.nan)
+    lat = df["latitude"].to_numpy(dtype=float, na_value=np.nan)
+    dvf_store = store.DVFStore(path)
+    assert_same_arrays(SpatialGrid.build(lon, lat), dvf_store.spatial_grid(),
+                       ("cells", "starts", "order", "x", "y", "rows"))
+    assert_same_arrays(KeyIndex.build(df["id_parcelle"]), dvf_store.parcel_index(),
+                       ("keys", "starts", "positions", "rows"))
+    assert_same_arrays(SurfaceIndex.build(df["code_postal"], df["code_type_local"], df["surface_reelle_bati"]),
+                       dvf_store.surface_index(), ("keys", "order", "rows"))
+    assert_same_arrays(FuzzyAddressIndex.build(df["adresse_complete"].dropna().astype(str).unique()),
+                       dvf_store.fuzzy_index(), ("addresses", "keys", "starts", "ids", "sizes", "numeros"))
+
+
+@check
+def colonnes_mappees(workdir):
+    path = synthetic_table(workdir, n_rows=20_000, seed=3)
+    memoire = store.DVFStore(path)
+    write_dvf_mmap(path, store.read_table(path, store.DVF_COLUMNS))
+    mappee = store.MappedDVFStore(path)
+    assert isinstance(mappee.aggregates(), MappedAggregates)
+    df = memoire.df
+    rng = np.random.default_rng(3)
+
+    assert_same_frames(memoire.df, mappee.df, "table")
+    for adresse in rng.choice(df["adresse_complete"].dropna().unique(), 50):
+        assert_same_frames(memoire.lookup_adresse(adresse), mappee.lookup_adresse(adresse), adresse)
+        assert memoire.resume_adresse(adresse) == mappee.resume_adresse(adresse), adresse
+        scores = [score for _, score in memoire.search_adresse(adresse)]
+        assert scores == [score for _, score in mappee.search_adresse(adresse)], adresse
+    for parcelle in rng.choice(df["id_parcelle"].unique(), 50):
+        assert_same_frames(memoire.lookup_parcelle(parcelle), mappee.lookup_parcelle(parcelle), parcelle)
+    for i in rng.integers(0, len(df), 50):
+        lon, lat = df["longitude"].iloc[i], df["latitude"].iloc[i]
+        assert_same_frames(memoire.lookup_around(lon, lat, 200), mappee.lookup_around(lon, lat, 200), "lookup_around")
+        surface = df["surface_reelle_bati"].iloc[i]
+        assert_same_frames(memoire.lookup_surface(surface, code_postal=df["code_postal"].iloc[i]),
+                           mappee.lookup_surface(surface, code_postal=df["code_postal"].iloc[i]), "lookup_surface")
+    for code_commune, voie in df[["code_commune", "adresse_nom_voie"]].drop_duplicates().head(20).itertuples(index=False):
+        assert_same_frames(memoire.prix_m2(code_commune), mappee.prix_m2(code_commune), code_commune)
+        assert_same_frames(memoire.prix_m2(code_commune, voie), mappee.prix_m2(code_commune, voie), voie)
+
+
+@check
+def versions_mappees(workdir):
+    workdir = os.path.join(workdir, "versions")
+    os.makedirs(workdir)
+    path = os.path.abspath(synthetic_table(workdir, n_rows=1_000, seed=5))
+    assert type(store.get_dvf_store(path)) is store.DVFStore
+    lignes = len(store.read_table(path, store.DVF_COLUMNS))
+    premiere = write_dvf_mmap(path, store.read_table(path, store.DVF_COLUMNS))
+    dvf_store = store.get_dvf_store(path)
+    assert isinstance(dvf_store, store.MappedDVFStore) and is_dvf_mmap_fresh(path)
+    assert (store.DVFStore, path) not in store._stores, "table en mémoire gardée à côté des colonnes mappées"
+
+    # table réécrite : l'ancienne version reste servie jusqu'à la suivante
+    export_dvf(traitement_dvf(make_synthetic_dvf(1_500, seed=6)), path)
+    assert not is_dvf_mmap_fresh(path)
+    assert store.get_dvf_store(path) is dvf_store and len(dvf_store.refresh()[1]) == lignes
+    table = store.read_table(path, store.DVF_COLUMNS)
+    seconde = write_dvf_mmap(path, table)
+    assert dvf_mmap_path(path) == seconde and is_dvf_mmap_fresh(path)
+    assert len(dvf_store.refresh()[1]) == len(table) != lignes
+    # la version précédente est gardée pour les process qui la lisent encore, pas les autres
+    assert os.path.exists(premiere)
+    troisieme = write_dvf_mmap(path, store.read_table(path, store.DVF_COLUMNS))
+    assert not os.path.exists(premiere) and os.path.exists(seconde) and dvf_mmap_path(path) == troisieme
+
+
+@check
+def resume_adresses(workdir):
+    df = traitement_dvf(make_synthetic_dvf(5_000, seed=4, n_voies=50))
+    rng = np.random.default_rng(4)
+    df.loc[rng.random(len(df)) < 0.1, "id_mutation"] = None
+    adresses = build_adresses(df).set_index("adresse_complete")
+
+    attendu = df.dropna(subset=["adresse_complete", "id_mutation"])
+    assert set(adresses.index) == set(attendu["adresse_complete"])
+    surfaces = attendu.dropna(subset=["surface_reelle_bati"]).groupby("adresse_complete")["surface_reelle_bati"]
+    surfaces = surfaces.agg(lambda values: sorted(set(values)))
+    for adresse, liste in adresses["surfaces"].items():
+        assert list(liste) == surfaces.get(adresse, []), adresse
+
+
+@check
+def anticipation_debit(workdir):
+    coords = get_coordinates_from_address("7 rue de l'anticipation 29200 Brest")
+    mock = get_client()
+    # débit partagé de chaque API épuisé par les requêtes des adresses validées
+    client = HTTPClient()
+    for limiter in client.rate_limiters.values():
+        while limiter.try_acquire():
+            pass
+    set_client(client)
+    try:
+        start = time.monotonic()
+        with speculative():
+            result = enrich_address(coords["adresse_label"], "jeton", coords=coords)
+        elapsed = time.monotonic() - start
+    finally:
+        set_client(mock)
+    assert set(result["errors"]) == {"cadastre", "dpe"}, result["errors"]
+    assert all("réservé" in error for error in result["errors"].values()), result["errors"]
+    assert elapsed < 0.5, f"{elapsed:.2f} s d'attente"
+    # refus du débit partagé : la part spéculative n'est pas entamée
+    for host, limiter in client.speculative_limiters.items():
+        assert limiter._tokens >= limiter.capacity - 1e-6, f"jeton spéculatif perdu pour {host}"
+
+
+@check
+def geocodage_masse(workdir):
+    host = HOSTS["ban"]
+    adresses = [f"{n} rue du geocodage en masse 29200 Brest" for n in range(1, 6)]
+    premier = dict(get_coordinates_bulk(adresses))
+    assert all("error" not in coords for coords in premier.values()), premier
+    requests_before = metrics.apis[host]["requests"]
+    second = dict(get_coordinates_bulk(adresses))
+    assert metrics.apis[host]["requests"] == requests_before, "adresses regéocodées"
+    assert second == premier
+    assert all(geocode_cache.get(geocode_cache_key(adresse)) is None for adresse in adresses)
+
+
+class _TruncatedCSV(BaseHTTPRequestHandler):
+    # annonce deux fois la taille envoyée puis ferme la connexion
+    def do_GET(self):
+        body = ("numero_dpe,etiquette_dpe\n" + "".join(f"D{i},A\n" for i in range(2_000))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(2 * len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+def _api_bytes(host):
+    return metrics.apis.get(host, {}).get("bytes", 0)
+
+
+@check
+def dpe_flux(workdir):
+    host = HOSTS["ademe"]
+    before = _api_bytes(host)
+    df = get_dpe_exact_coordinates(146619.4, 6836100.72, "jeton", local=False)
+    assert "error" not in df.columns and len(df), df
+    assert _api_bytes(host) > before, "octets des réponses en streaming non comptés"
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _TruncatedCSV)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    mock = get_client()
+    client = HTTPClient(rate_limits={host: None})
+    client.mount(f"https://{host}", LocalStubAdapter(f"http://127.0.0.1:{httpd.server_port}"))
+    set_client(client)
+    try:
+        before = _api_bytes(host)
+        df = get_dpe_exact_coordinates(146000.0, 6836000.0, "jeton", local=False)
+    finally:
+        set_client(mock)
+        httpd.shutdown()
+    assert list(df.columns) == ["error"], df
+    assert _api_bytes(host) > before
+
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir, MockAPIServer() as server:
+        install_mock(server, rate_limits=False)
+        for function in CHECKS:
+            try:
+                function(workdir)
+            except Exception:
+                failures += 1
+                print(f"ÉCHEC {function.__name__}")
+                traceback.print_exc()
+            else:
+                print(f"ok    {function.__name__}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Serveur HTTP local qui rejoue des réponses de la BAN (/search/ et /search/csv/),
+du géocodage inverse de la géoplateforme (parcelles) et de l'API ADEME dpe03existant,
+avec une latence réglable par service.
+
+Les réponses de benchmarks/fixtures ne sont pas des enregistrements : elles sont reconstituées
+au format documenté des API (champs, noms de colonnes, pagination), autour d'un même point
+de Brest, avec des x/y Lambert-93 recalculés depuis longitude/latitude
+(benchmarks/checks.py vérifie leur cohérence).
+
+    python benchmarks/mock_server.py --port 8765 --latency 0.03 --latency ademe=0.15
+
+install_mock() branche le client HTTP partagé de l'app sur ce serveur
+(http_client.LocalStubAdapter) : utils.py s'exécute sans réseau.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from http_client import HTTPClient, LocalStubAdapter, set_client  # noqa: E402
+from spatial_index import lonlat_to_lambert93  # noqa: E402
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Hôte réel de chaque service rejoué
+HOSTS = {
+    "ban": "api-adresse.data.gouv.fr",
+    "geopf": "data.geopf.fr",
+    "ademe": "data.ademe.fr",
+}
+
+
+def _load_fixtures(path):
+    with open(os.path.join(path, "ban_search.json"), encoding="utf-8") as f:
+        ban = json.load(f)
+    with open(os.path.join(path, "geopf_reverse.json"), encoding="utf-8") as f:
+        geopf = json.load(f)
+    with open(os.path.join(path, "dpe03existant.csv"), encoding="utf-8", newline="") as f:
+        dpe = list(csv.DictReader(f))
+    return ban, geopf, dpe
+
+
+def geocode(query, template):
+    """
+    Réponse BAN pour `query`, construite sur la réponse reconstituée `template` :
+    le libellé est la requête elle-même et le point est décalé de quelques dizaines
+    de mètres selon une empreinte de la requête (même requête, même point).
+    """
+    feature = json.loads(json.dumps(template["features"][0]))
+    digest = zlib.crc32(query.encode("utf-8"))
+    lon, lat = feature["geometry"]["coordinates"]
+    lon += ((digest & 0xFFFF) / 0xFFFF - 0.5) * 1e-3
+    lat += ((digest >> 16) / 0xFFFF - 0.5) * 1e-3
+    x, y = lonlat_to_lambert93(lon, lat)
+    postcode = next((word for word in query.replace(",", " ").split() if len(word) == 5 and word.isdigit()),
+                    feature["properties"]["postcode"])
+    feature["geometry"]["coordinates"] = [round(lon, 6), round(lat, 6)]
+    feature["properties"].update(label=query, postcode=postcode, x=round(float(x), 2), y=round(float(y), 2))
+    return feature
+
+
+class MockAPIServer:
+    """
+    Serveur des réponses reconstituées, dans un thread du process.
+    `latency` : attente avant chaque réponse, en secondes, soit un nombre pour tous
+    les services, soit un dict {"ban", "geopf", "ademe"} (0 pour un service absent).
+    Les DPE sont paginés comme l'API ADEME (paramètres size et after, lien "next").
+    """
+
+    def __init__(self, port=0, latency=0.0, fixtures=FIXTURES):
+        self.latency = latency if isinstance(latency, dict) else {service: latency for service in HOSTS}
+        self.ban, self.geopf, self.dpe = _load_fixtures(fixtures)
+        self.requests = {service: 0 for service in HOSTS}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self, None)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server._handle(self, body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="mock-api")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, handler, body):
+        parts = urlsplit(handler.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if parts.path == "/search/csv/":
+            service, response = "ban", self._ban_csv(handler.headers, body)
+        elif parts.path.startswith("/search"):
+            service, response = "ban", self._ban_search(params)
+        elif parts.path.startswith("/geocodage/reverse"):
+            service, response = "geopf", ("application/json", json.dumps(self.geopf), {})
+        elif parts.path.endswith("/dpe03existant/lines"):
+            service, response = "ademe", self._dpe_lines(parts.path, params)
+        else:
+            handler.send_error(404)
+            return
+        self.requests[service] += 1
+        time.sleep(self.latency.get(service, 0))
+        content_type, text, headers = response
+        payload = text.encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _ban_search(self, params):
+        response = dict(self.ban, query=params.get("q", ""), features=[geocode(params.get("q", ""), self.ban)])
+        return "application/json", json.dumps(response, ensure_ascii=False), {}
+
+    def _ban_csv(self, headers, body):
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        data = next(part for part in message.iter_parts() if part.get_param("name", header="content-disposition") == "data")
+        rows = list(csv.DictReader(io.StringIO(data.get_payload(decode=True).decode("utf-8"))))
+        out = io.StringIO()
+        # comme la BAN : pas de x/y Lambert-93 dans la réponse CSV, seulement longitude/latitude
+        columns = ["longitude", "latitude", "result_label", "result_score",
+                   "result_postcode", "result_citycode"]
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]) + columns if rows else columns)
+        writer.writeheader()
+        for row in rows:
+            feature = geocode(row.get("adresse", ""), self.ban)
+            properties = feature["properties"]
+            writer.writerow({
+                **row,
+                "longitude": feature["geometry"]["coordinates"][0],
+                "latitude": feature["geometry"]["coordinates"][1],
+                "result_label": properties["label"],
+                "result_score": properties["score"],
+                "result_postcode": properties["postcode"],
+                "result_citycode": properties["citycode"],
+            })
+        return "text/csv; charset=utf-8", out.getvalue(), {}
+
+    def _dpe_lines(self, path, params):
+        size = int(params.get("size", 12))
+        after = int(params.get("after", 0))
+        rows = self.dpe[after:after + size]
+        next_url = None
+        if after + size < len(self.dpe):
+            next_url = f"https://{HOSTS['ademe']}{path}?" + urlencode({**params, "after": after + size})
+        select = params.get("select")
+        if select:
+            # comme data-fair : `select` prend les clés de l'API (sans espace), les lignes gardent les noms d'origine
+            names = {name.replace(" ", "_"): name for name in self.dpe[0]}
+            columns = [names.get(key, key) for key in select.split(",")]
+            rows = [{name: row.get(name) for name in columns} for row in rows]
+        if params.get("format") == "csv":
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=columns if select else list(self.dpe[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+            headers = {"Link": f'<{next_url}>; rel="next"'} if next_url else {}
+            return "text/csv; charset=utf-8", out.getvalue(), headers
+        response = {"total": len(self.dpe), "results": rows}
+        if next_url:
+            response["next"] = next_url
+        return "application/json", json.dumps(response, ensure_ascii=False), {}
+
+
+def install_mock(server, rate_limits=True):
+    """
+    Remplace le client HTTP partagé par un client dont les trois hôtes sont servis
+    par `server`. Sans `rate_limits`, les débits maximaux par hôte sont levés.
+    Renvoie le nouveau client.
+    """
+    client = HTTPClient(rate_limits=None if rate_limits else {host: None for host in HOSTS.values()})
+    for host in HOSTS.values():
+        client.mount(f"https://{host}", LocalStubAdapter(server.url))
+    set_client(client)
+    return client
+
+
+def parse_latency(values):
+    """
+    Latences de la ligne de commande : "0.03" pour tous les services, "ademe=0.15" pour un seul.
+    """
+    latency = {service: 0.0 for service in HOSTS}
+    for value in values or []:
+        service, _, seconds = value.rpartition("=")
+        for name in ([service] if service else HOSTS):
+            latency[name] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local des réponses BAN, géoplateforme et ADEME reconstituées.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", help="latence en secondes, [service=]secondes (répétable)")
+    parser.add_argument("--fixtures", default=FIXTURES, help="dossier des réponses reconstituées")
+    args = parser.parse_args()
+
+    server = MockAPIServer(args.port, parse_latency(args.latency), args.fixtures)
+    print(f"réponses reconstituées servies sur {server.url} (Ctrl+C pour arrêter)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Bancs d'essai reproductibles, sans réseau : les API BAN, géoplateforme et ADEME
+sont remplacées par benchmarks/mock_server.py (latence réglable) et le DVF est synthétique.
+
+    python benchmarks/run_benchmarks.py --size 10k --latency 0.03 --latency ademe=0.15
+    python benchmarks/run_benchmarks.py --size 1M --output bench_1M.json --baseline bench_1M_ref.json
+
+Mesures :
+- traitement_dvf : débit en mémoire (jusqu'à 1M lignes) et débit de la chaîne
+  par blocs traitement_dvf_streaming (CSV brut -> Parquet), construction des index ;
+- recherche unitaire : percentiles de latence de la table DVF seule et de enrich_address,
+  caches froids puis chauds ;
+- batch : débit de run_batch (fiches par seconde) ;
+- anticipation : latence de validation d'une adresse suggérée pendant la frappe
+  (Prefetcher), après une pause de lecture de PREFETCH_PAUSE secondes.
+Avec --baseline, une mesure dégradée de plus de --tolerance fait échouer la commande.
+Les mesures ne vérifient pas les résultats : voir benchmarks/checks.py.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# caches en mémoire : les bancs d'essai ne touchent jamais au cache.sqlite de l'app
+os.environ["CACHE_PATH"] = ":memory:"
+# pas d'index DPE local : les DPE passent par l'API rejouée
+os.environ["DPE_PATH"] = os.path.join(tempfile.gettempdir(), "bench_sans_index_dpe.parquet")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import store  # noqa: E402
+from batch import run_batch  # noqa: E402
+from benchmarks.mock_server import MockAPIServer, install_mock, parse_latency  # noqa: E402
+from benchmarks.synthetic_dvf import parse_size, write_synthetic_dvf  # noqa: E402
+from pipeline import enrich_address  # noqa: E402
+from prefetch import Prefetcher  # noqa: E402
+from utils import (  # noqa: E402
+    autocomplete_cache, dpe_cache, geocode_bulk_cache, geocode_cache, geocode_negative_cache, traitement_dvf,
+    traitement_dvf_streaming
+)
+
+
+# Nombre de lignes au-delà duquel traitement_dvf n'est plus mesuré en mémoire
+IN_MEMORY_MAX_ROWS = 1_000_000
+
+# Pause entre l'affichage des suggestions et le choix de l'adresse (secondes)
+PREFETCH_PAUSE = 0.5
+
+
+def percentiles(durations):
+    durations = np.asarray(durations) * 1000
+    return {f"p{q}_ms": float(np.percentile(durations, q)) for q in (50, 95, 99)}
+
+
+def clear_caches():
+    for cache in (geocode_cache, geocode_negative_cache, geocode_bulk_cache, dpe_cache, autocomplete_cache):
+        cache.clear()
+
+
+def bench_traitement(raw_path, dvf_path, rows, workers):
+    results = {}
+    sample = pd.read_csv(raw_path, sep=',', dtype=str, nrows=min(rows, IN_MEMORY_MAX_ROWS))
+    start = time.perf_counter()
+    traitement_dvf(sample)
+    results["traitement_dvf_rows_per_s"] = len(sample) / (time.perf_counter() - start)
+    del sample
+
+    start = time.perf_counter()
+    written = traitement_dvf_streaming(raw_path, dvf_path, workers=workers)
+    results["streaming_rows_per_s"] = rows / (time.perf_counter() - start)
+    results["rows_written"] = written
+
+    dvf_store = store.get_dvf_store(dvf_path)
+    start = time.perf_counter()
+    dvf_store.refresh()
+    dvf_store.spatial_grid()
+    dvf_store.parcel_index()
+    dvf_store.fuzzy_index()
+    results["load_and_index_s"] = time.perf_counter() - start
+    return results
+
+
+def bench_lookup(addresses):
+    results = {}
+    dvf_store = store.get_dvf_store()
+    durations = []
+    for adresse in addresses:
+        start = time.perf_counter()
+        dvf_store.lookup_adresse(adresse)
+        durations.append(time.perf_counter() - start)
+    results.update({f"dvf_lookup_{key}": value for key, value in percentiles(durations).items()})
+
+    for passe in ("froid", "chaud"):
+        durations = []
+        for adresse in addresses:
+            start = time.perf_counter()
+            enrich_address(adresse, "benchmark")
+            durations.append(time.perf_counter() - start)
+        results.update({f"enrich_{passe}_{key}": value for key, value in percentiles(durations).items()})
+    return results
+
+
+def bench_prefetch(addresses):
+    """
+    Frappe simulée mot par mot (une mise à jour des suggestions par mot), pause,
+    puis validation de l'adresse complète.
+    """
+    durations = []
+    for adresse in addresses:
+        prefetcher = Prefetcher("benchmark")
+        mots = adresse.split()
+        for n in range(1, len(mots) + 1):
+            prefetcher.update(" ".join(mots[:n]))
+        time.sleep(PREFETCH_PAUSE)
+        start = time.perf_counter()
+        prefetcher.result(adresse) or enrich_address(adresse, "benchmark")
+        durations.append(time.perf_counter() - start)
+        prefetcher.cancel()
+    return {f"prefetch_submit_{key}": value for key, value in percentiles(durations).items()}
+
+
+def bench_batch(addresses, workdir, workers):
+    input_path = os.path.join(workdir, "adresses.csv")
+    output_path = os.path.join(workdir, "fiches.csv")
+    pd.DataFrame({"adresse": addresses}).to_csv(input_path, index=False)
+    start = time.perf_counter()
+    written = run_batch(input_path, output_path, "benchmark", workers=workers)
+    return {"batch_fiches_per_s": written / (time.perf_counter() - start)}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Mesures dégradées de plus de `tolerance` par rapport à `baseline` :
+    un débit (_per_s) plus bas ou une durée (_ms, _s) plus haute.
+    """
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if not old:
+            continue
+        if key.endswith("_per_s"):
+            degraded = value < old * (1 - tolerance)
+        elif key.endswith("_ms") or key.endswith("_s"):
+            degraded = value > old * (1 + tolerance)
+        else:
+            continue
+        if degraded:
+            regressions.append(f"{key} : {old:,.3f} -> {value:,.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bancs d'essai de l'enrichissement des fiches de bien (sans réseau).")
+    parser.add_argument("--size", default="10k", help="taille du DVF synthétique : 10k, 1M, 10M ou un nombre de lignes")
+    parser.add_argument("--lookups", type=int, default=200, help="nombre d'adresses pour les latences unitaires")
+    parser.add_argument("--batch", type=int, default=500, help="nombre d'adresses du batch")
+    parser.add_argument("--prefetch", type=int, default=20, help="nombre d'adresses saisies pour l'anticipation")
+    parser.add_argument("--workers", type=int, default=16, help="adresses traitées en parallèle par le batch")
+    parser.add_argument("--processes", type=int, default=1, help="processus pour traitement_dvf_streaming")
+    parser.add_argument("--latency", action="append", help="latence des API rejouées, [service=]secondes (répétable)")
+    parser.add_argument("--rate-limits", action="store_true", help="garder les débits maximaux par hôte du client HTTP")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="fichier JSON où écrire les résultats")
+    parser.add_argument("--baseline", help="résultats JSON de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="dégradation tolérée par rapport à la référence")
+    args = parser.parse_args()
+
+    rows = parse_size(args.size)
+    latency = parse_latency(args.latency)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, MockAPIServer(latency=latency) as server:
+        install_mock(server, rate_limits=args.rate_limits)
+        raw_path = write_synthetic_dvf(os.path.join(workdir, "dvf_brut.csv"), rows, seed=args.seed)
+        dvf_path = os.path.join(workdir, "dvf_ok.parquet")
+        store.DVF_PATH = dvf_path
+
+        results.update(bench_traitement(raw_path, dvf_path, rows, args.processes))
+
+        rng = np.random.default_rng(args.seed)
+        adresses = pd.read_parquet(dvf_path, columns=["adresse_complete"])["adresse_complete"].unique()
+        tirage = rng.permutation(adresses)
+        clear_caches()
+        results.update(bench_lookup(tirage[:args.lookups]))
+        clear_caches()
+        results.update(bench_batch(tirage[args.lookups:args.lookups + args.batch], workdir, args.workers))
+        clear_caches()
+        debut = args.lookups + args.batch
+        results.update(bench_prefetch(tirage[debut:debut + args.prefetch]))
+        results["api_requests"] = dict(server.requests)
+
+    report = {
+        "parametres": {**vars(args), "rows": rows, "latency": latency},
+        "environnement": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "machine": platform.machine(),
+        },
+        "resultats": results,
+    }
+    for key, value in results.items():
+        print(f"{key:<32} {value:>14,.3f}" if isinstance(value, float) else f"{key:<32} {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["resultats"], args.tolerance)
+        if regressions:
+            print("régressions :")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"aucune régression au-delà de {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Générateurs de DVF brut synthétique (mêmes colonnes principales que le fichier Etalab),
+reproductibles à graine fixe, aux tailles des bancs d'essai.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Tailles des bancs d'essai, en lignes
+SIZES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}
+
+COMMUNES = [
+    ("29200", "29019", "Brest"),
+    ("29000", "29232", "Quimper"),
+    ("29600", "29151", "Morlaix"),
+    ("29800", "29103", "Landerneau"),
+    ("29400", "29118", "Landivisiau"),
+]
+VOIES = ["RUE DE SIAM", "AV CLEMENCEAU", "RUE DE L'ÉGLISE", "BD GAMBETTA", "KERMEN", ""]
+TYPES_LOCAL = {1: "Maison", 2: "Appartement", 3: "Dépendance", 4: "Local industriel. commercial ou assimilé"}
+
+
+def parse_size(size):
+    """
+    Nombre de lignes d'une taille nommée ("10k", "1M", "10M") ou écrite en chiffres.
+    """
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def make_synthetic_dvf(n_rows, seed=0, n_voies=0, offset=0):
+    """
+    Génère un DVF brut, avec des doublons et une ligne d'en-tête répétée
+    comme dans les fichiers concaténés.
+    `n_voies` ajoute des voies numérotées à VOIES (adresses plus variées, comme un vrai
+    département) ; `offset` décale les identifiants de mutation (génération par blocs).
+    """
+    rng = np.random.default_rng(seed)
+    voies = np.array(VOIES + [f"RUE DE KERANGUEN {k}" for k in range(n_voies)])
+    commune = rng.integers(0, len(COMMUNES), n_rows)
+    code_type_local = rng.integers(1, 5, n_rows)
+    numero = rng.integers(1, 150, n_rows).astype(float)
+    numero[rng.random(n_rows) < 0.05] = np.nan
+
+    df = pd.DataFrame({
+        "id_mutation": [f"2023-{i}" for i in range(offset, offset + n_rows)],
+        "date_mutation": (pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500, n_rows), unit="D")).strftime("%Y-%m-%d"),
+        "nature_mutation": "Vente",
+        "valeur_fonciere": rng.integers(20, 600, n_rows) * 1000.0,
+        "adresse_numero": numero,
+        "adresse_suffixe": np.where(rng.random(n_rows) < 0.1, "B", None),
+        "adresse_nom_voie": voies[rng.integers(0, len(voies), n_rows)],
+        "code_postal": [COMMUNES[i][0] for i in commune],
+        "code_commune": [COMMUNES[i][1] for i in commune],
+        "nom_commune": [COMMUNES[i][2] for i in commune],
+        "id_parcelle": [f"{COMMUNES[i][1]}000AB{p:04d}" for i, p in zip(commune, rng.integers(1, 500, n_rows))],
+        "code_type_local": code_type_local,
+        "type_local": [TYPES_LOCAL[c] for c in code_type_local],
+        "surface_reelle_bati": rng.integers(15, 200, n_rows),
+        "nombre_pieces_principales": rng.integers(1, 8, n_rows),
+        "surface_terrain": np.where(rng.random(n_rows) < 0.5, np.nan, rng.integers(50, 2000, n_rows)),
+        "longitude": -4.48 + rng.random(n_rows) * 0.05,
+        "latitude": 48.39 + rng.random(n_rows) * 0.05,
+    })
+    df = pd.concat([df, df.sample(frac=0.05, random_state=seed)], ignore_index=True)
+    header = pd.DataFrame([{col: col for col in df.columns}])
+    return pd.concat([df.iloc[: n_rows // 2], header, df.iloc[n_rows // 2:]], ignore_index=True)
+
+
+def write_synthetic_dvf(path, n_rows, seed=0, chunk_rows=1_000_000):
+    """
+    Écrit un DVF brut synthétique de `n_rows` lignes dans le CSV `path`, bloc par bloc
+    (10M lignes sans tout garder en mémoire). Une voie pour 200 lignes environ.
+    Renvoie `path`.
+    """
+    for start in range(0, n_rows, chunk_rows):
+        rows = min(chunk_rows, n_rows - start)
+        chunk = make_synthetic_dvf(rows, seed=seed + start, n_voies=max(n_rows // 200, 1), offset=start)
+        chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    return path
@@ -0,0 +1,190 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+
+# Taille maximale par défaut d'une table du cache disque (lignes), et fréquence du ménage
+# (entrées expirées et excédent supprimés toutes les PURGE_EVERY écritures)
+DISK_MAXSIZE = 100_000
+PURGE_EVERY = 500
+
+
+class LRUCache:
+    """
+    Cache mémoire LRU, avec une durée de vie (TTL, en secondes) par entrée.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Renvoie (valeur, date d'expiration), ou None si la clé est absente ou expirée.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl=None, expires=None):
+        if expires is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache:
+    """
+    Cache sur disque (une table SQLite), conservé entre deux redémarrages.
+    Les valeurs sont sérialisées avec pickle. Les entrées expirées sont supprimées à la lecture
+    et lors du ménage périodique, qui ramène aussi la table à `maxsize` lignes.
+    """
+
+    def __init__(self, path, table, ttl=None, maxsize=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.maxsize = maxsize  # nombre maximal de lignes (None : sans limite)
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self):
+        # connexion ouverte au premier accès, partagée entre threads sous verrou
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table} (expires)")
+            # les entrées expirées laissées par les process précédents
+            self._purge(self._conn)
+        return self._conn
+
+    def _purge(self, conn):
+        """
+        Supprime les entrées expirées puis, au-delà de `maxsize` lignes,
+        celles qui expirent le plus tôt.
+        """
+        conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),))
+        if self.maxsize is not None:
+            excess = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.maxsize
+            if excess > 0:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY expires IS NULL, expires LIMIT ?)",
+                    (excess,)
+                )
+        conn.commit()
+
+    def get(self, key):
+        """
+        Renvoie (valeur, date d'expiration), ou None si la clé est absente ou expirée
+        (une entrée expirée est supprimée).
+        """
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] < time.time():
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                conn.commit()
+                return None
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl=None, expires=None):
+        if expires is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+                (key, pickle.dumps(value), expires)
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._purge(conn)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+
+
+class TieredCache:
+    """
+    Cache à deux niveaux : mémoire (LRU) puis disque (SQLite, si `path` est renseigné,
+    au plus `disk_maxsize` lignes). Compte les succès par niveau et les échecs.
+    """
+
+    def __init__(self, name, ttl=None, maxsize=1024, path=None, disk_maxsize=DISK_MAXSIZE):
+        self.name = name
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteCache(path, table=name, ttl=ttl, maxsize=disk_maxsize) if path else None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        metrics.register_cache(self)
+
+    def get(self, key, default=None):
+        key = str(key)
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.counters["memory_hits"] += 1
+            return entry[0]
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.counters["disk_hits"] += 1
+                # remontée en mémoire avec la même date d'expiration
+                self.memory.set(key, entry[0], expires=entry[1])
+                return entry[0]
+        self.counters["misses"] += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        key = str(key)
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        self.memory.set(key, value, expires=expires)
+        if self.disk is not None:
+            self.disk.set(key, value, expires=expires)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        total = hits + self.counters["misses"]
+        return {**self.counters, "hit_rate": hits / total if total else None}
+
+
+CACHE_PATH = os.getenv("CACHE_PATH", "cache.sqlite")
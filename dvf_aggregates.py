@@ -0,0 +1,173 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Périodes glissantes des prix au m², en mois avant la mutation la plus récente de la table
+PERIODES_MOIS = (12, 36, 60)
+
+# type_local des médianes tous types confondus
+TOUS_TYPES = "Tous"
+
+
+def _mutations_par_adresse(df):
+    """
+    Une ligne par (adresse, mutation) : date, valeur foncière, type de local
+    et surface bâtie totale de la mutation à cette adresse.
+    """
+    return (
+        df.groupby(["adresse_complete", "id_mutation"], sort=False, observed=True)
+        .agg(date_mutation=("date_mutation", "first"), valeur_fonciere=("valeur_fonciere", "first"),
+             type_local=("type_local", "first"), surface_reelle_bati=("surface_reelle_bati", "sum"))
+        .reset_index()
+    )
+
+
+def build_adresses(df):
+    """
+    Résumé par adresse, trié par adresse : dernière mutation (date, valeur, type, surface),
+    nombre de mutations et surfaces bâties distinctes (triées).
+    Les lignes sans adresse ou sans mutation sont ignorées.
+    """
+    # même sélection pour les mutations et les surfaces : les listes de surfaces
+    # sont découpées dans l'ordre des adresses du résumé
+    df = df.dropna(subset=["adresse_complete", "id_mutation"])
+    mutations = _mutations_par_adresse(df).sort_values(["adresse_complete", "date_mutation"], kind="stable")
+    adresses = mutations.drop_duplicates("adresse_complete", keep="last").set_index("adresse_complete")
+    adresses = adresses.drop(columns="id_mutation").add_suffix("_derniere_mutation")
+    adresses["nb_mutations"] = mutations.groupby("adresse_complete", sort=False).size()
+    # surfaces distinctes rangées par adresse : une liste Arrow construite sans boucle Python
+    surfaces = (
+        df[["adresse_complete", "surface_reelle_bati"]].dropna().drop_duplicates()
+        .sort_values(["adresse_complete", "surface_reelle_bati"])
+    )
+    counts = surfaces.groupby("adresse_complete").size().reindex(adresses.index, fill_value=0).to_numpy()
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    values = pa.array(surfaces["surface_reelle_bati"].to_numpy(dtype=np.int64))
+    adresses["surfaces"] = pa.ListArray.from_arrays(pa.array(offsets), values).to_pandas().to_numpy()
+    return adresses.reset_index()
+
+
+def build_prix_m2(df, periodes=PERIODES_MOIS):
+    """
+    Médiane de valeur_fonciere / m² bâti par commune et par voie (code_commune|adresse_nom_voie),
+    par type de local et tous types confondus, sur chaque période glissante.
+    Une mutation de plusieurs lots compte une fois, avec la somme de leurs surfaces.
+    """
+    if "nature_mutation" in df.columns:
+        df = df[df["nature_mutation"] == "Vente"]
+    mutations = (
+        df.dropna(subset=["id_mutation"])
+        .groupby("id_mutation", sort=False, observed=True)
+        .agg(date_mutation=("date_mutation", "first"), valeur_fonciere=("valeur_fonciere", "first"),
+             surface=("surface_reelle_bati", "sum"), type_local=("type_local", "first"),
+             code_commune=("code_commune", "first"), adresse_nom_voie=("adresse_nom_voie", "first"))
+    )
+    mutations = mutations[(mutations["surface"] > 0) & (mutations["valeur_fonciere"] > 0)].copy()
+    mutations["prix_m2"] = mutations["valeur_fonciere"] / mutations["surface"].astype(float)
+    mutations["type_local"] = mutations["type_local"].astype(str)
+    mutations["commune"] = mutations["code_commune"].astype(str)
+    mutations["voie"] = mutations["commune"] + "|" + mutations["adresse_nom_voie"].fillna("").astype(str)
+    dates = pd.to_datetime(mutations["date_mutation"], errors="coerce")
+
+    tables = []
+    for mois in periodes:
+        recentes = mutations[dates > dates.max() - pd.DateOffset(months=mois)]
+        for niveau in ("commune", "voie"):
+            for par_type in (True, False):
+                cles = [niveau, "type_local"] if par_type else [niveau]
+                table = recentes.groupby(cles, observed=True)["prix_m2"].agg(["median", "size"]).reset_index()
+                if not par_type:
+                    table["type_local"] = TOUS_TYPES
+                tables.append(table.rename(columns={niveau: "cle", "median": "prix_m2_median", "size": "nb_mutations"})
+                              .assign(niveau=niveau, periode_mois=mois))
+    columns = ["niveau", "cle", "type_local", "periode_mois", "prix_m2_median", "nb_mutations"]
+    return pd.concat(tables, ignore_index=True)[columns].sort_values(columns[:4], ignore_index=True)
+
+
+class DVFAggregates:
+    """
+    Tables agrégées de la table DVF : résumé par adresse et prix médians au m²,
+    indexées (index pandas) pour une recherche en temps constant.
+    """
+
+    def __init__(self, adresses, prix_m2, rows):
+        self.adresses = adresses.set_index("adresse_complete")
+        self.prix = prix_m2
+        self.rows = rows    # nombre de lignes de la table DVF agrégée
+        # colonnes du résumé en tableaux numpy, lus directement à la position de l'adresse
+        self._colonnes = {col: self.adresses[col].to_numpy() for col in self.adresses.columns}
+        self._prix_positions = prix_m2.groupby(["niveau", "cle", "type_local"], sort=False).indices
+        self._prix_colonnes = {col: prix_m2[col].to_numpy() for col in ("periode_mois", "prix_m2_median", "nb_mutations")}
+
+    @classmethod
+    def build(cls, df):
+        return cls(build_adresses(df), build_prix_m2(df), len(df))
+
+    def save(self, table_path):
+        for path, df in ((adresses_path(table_path), self.adresses.reset_index()),
+                         (prix_m2_path(table_path), self.prix)):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata({**table.schema.metadata, b"rows": str(self.rows).encode()})
+            pq.write_table(table, path, compression="zstd")
+
+    @classmethod
+    def load(cls, table_path):
+        tables = [pq.read_table(path) for path in (adresses_path(table_path), prix_m2_path(table_path))]
+        rows = {int(table.schema.metadata[b"rows"]) for table in tables}
+        return cls(tables[0].to_pandas(), tables[1].to_pandas(), rows.pop() if len(rows) == 1 else -1)
+
+    def adresse(self, adresse_complete):
+        """
+        Résumé de l'adresse (dict), ou None si elle n'a aucune mutation.
+        """
+        try:
+            position = self.adresses.index.get_loc(adresse_complete)
+        except KeyError:
+            return None
+        # scalaires et tableaux numpy convertis en types Python (surfaces : liste d'entiers)
+        return {col: values[position].tolist() if isinstance(values[position], (np.generic, np.ndarray))
+                else values[position] for col, values in self._colonnes.items()}
+
+    def prix_m2(self, niveau, cle, type_local=TOUS_TYPES):
+        """
+        Prix médian au m² et nombre de mutations de chaque période pour la commune
+        ou la voie `cle` (table vide si inconnue).
+        """
+        positions = self._prix_positions.get((niveau, str(cle), type_local), np.empty(0, dtype=np.intp))
+        return pd.DataFrame({col: values[positions] for col, values in self._prix_colonnes.items()})
+
+
+def adresses_path(table_path):
+    """
+    Fichier du résumé par adresse rangé à côté de la table.
+    """
+    return f"{table_path}.adresses.parquet"
+
+
+def prix_m2_path(table_path):
+    """
+    Fichier des prix médians au m² rangé à côté de la table.
+    """
+    return f"{table_path}.prix_m2.parquet"
+
+
+def load_or_build_aggregates(table_path, df):
+    """
+    Charge les tables agrégées si elles sont à jour, sinon les reconstruit
+    et essaie de les enregistrer à côté de la table.
+    """
+    paths = [adresses_path(table_path), prix_m2_path(table_path)]
+    if all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(table_path) for path in paths):
+        aggregates = DVFAggregates.load(table_path)
+        if aggregates.rows == len(df):
+            return aggregates
+    aggregates = DVFAggregates.build(df)
+    try:
+        aggregates.save(table_path)
+    except OSError:
+        pass
+    return aggregates
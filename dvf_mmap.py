@@ -0,0 +1,321 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from dvf_aggregates import TOUS_TYPES, DVFAggregates
+from fuzzy_index import FuzzyAddressIndex
+from key_index import KeyIndex
+from spatial_index import SpatialGrid
+from surface_index import SurfaceIndex
+
+
+# Valeur manquante des colonnes entières (stockées en int32)
+INT_NA = np.iinfo(np.int32).min
+
+# Colonnes texte avec liste inversée valeur -> lignes (recherche par égalité)
+INDEXED_COLUMNS = ["adresse_complete", "id_parcelle"]
+
+GRID_CELL_SIZE = 50.0
+
+
+def dvf_mmap_pointer(table_path):
+    """
+    Fichier qui désigne la version courante des colonnes mappées (nom du dossier),
+    remplacé d'un bloc (os.replace) quand une nouvelle version est prête.
+    """
+    return f"{table_path}.mmap.courante"
+
+
+def _version_path(table_path, version):
+    return f"{table_path}.mmap.{version}"
+
+
+def _versions(table_path):
+    """
+    Numéros des dossiers de version présents à côté de la table, triés.
+    """
+    directory, prefix = os.path.split(f"{table_path}.mmap.")
+    return sorted(int(name[len(prefix):]) for name in os.listdir(directory or ".")
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def dvf_mmap_path(table_path):
+    """
+    Dossier de la version courante des colonnes mappées de la table, ou None s'il n'y en a pas.
+    """
+    try:
+        with open(dvf_mmap_pointer(table_path)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(os.path.dirname(table_path), name)
+
+
+def table_signature(table_path):
+    """
+    Taille et date de modification (ns) de la table, enregistrées avec les colonnes mappées.
+    """
+    stat = os.stat(table_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_dvf_mmap_fresh(table_path):
+    """
+    Vrai si la version courante des colonnes mappées a été écrite depuis la table dans son état actuel.
+    """
+    path = dvf_mmap_path(table_path)
+    if path is None:
+        return False
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f).get("table") == table_signature(table_path)
+
+
+def _numeric(series):
+    # colonnes catégorielles à catégories numériques (code_postal en Parquet) : décodées
+    if isinstance(series.dtype, pd.CategoricalDtype) and pd.api.types.is_numeric_dtype(series.dtype.categories):
+        return pd.to_numeric(series.astype(object), errors="coerce").astype("Int64")
+    return series
+
+
+def _utf8(values):
+    # textes en UTF-8 à largeur fixe : l'ordre des octets est celui des textes
+    if len(values) == 0:
+        return np.empty(0, dtype="S1")
+    return np.char.encode(np.asarray(values, dtype=str), "utf-8")
+
+
+def _encode(series):
+    """
+    Dictionnaire trié (UTF-8, largeur fixe) et codes int32 de chaque ligne (-1 : valeur manquante).
+    """
+    codes, uniques = pd.factorize(series.astype(object), sort=True)
+    return _utf8(uniques), codes.astype(np.int32)
+
+
+def _column_arrays(name, series):
+    """
+    Tableaux de la colonne `series` rangés sous `name`, et son type :
+    - nombres : float64, ou int32 avec INT_NA pour les entiers ;
+    - textes : dictionnaire trié des valeurs distinctes + codes int32.
+    """
+    series = _numeric(series)
+    if pd.api.types.is_float_dtype(series.dtype):
+        return {name: series.to_numpy(dtype=np.float64, na_value=np.nan)}, "float"
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return {name: series.to_numpy(dtype=np.int64, na_value=INT_NA).astype(np.int32)}, "int"
+    keys, codes = _encode(series)
+    return {f"{name}.keys": keys, f"{name}.codes": codes}, "str"
+
+
+def _decode(arrays, name, kind, positions):
+    """
+    Valeurs de la colonne `name` aux `positions` (inverse de _column_arrays).
+    """
+    if kind == "float":
+        return arrays[name][positions]
+    if kind == "int":
+        values = arrays[name][positions].astype(np.int64)
+        return pd.arrays.IntegerArray(values, values == INT_NA)
+    keys, codes = arrays[f"{name}.keys"], arrays[f"{name}.codes"][positions]
+    return [keys[code].decode("utf-8") if code >= 0 else None for code in codes]
+
+
+def _postings(codes, n_keys):
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(codes[order], minlength=n_keys))])
+    return starts, order
+
+
+def _aggregate_arrays(aggregates):
+    """
+    Tableaux des tables agrégées, et types des colonnes du résumé par adresse :
+    - résumé : adresses triées (UTF-8) et une valeur par adresse, surfaces en liste
+      (début de chaque adresse dans les valeurs, + fin de la dernière) ;
+    - prix au m² : index "niveau|clé|type" -> lignes, et colonnes des lignes.
+    """
+    adresses = aggregates.adresses
+    arrays, kinds = {"resume.adresse": _utf8(adresses.index)}, {}
+    for col in adresses.columns.drop("surfaces"):
+        column_arrays, kinds[col] = _column_arrays(f"resume.{col}", adresses[col])
+        arrays.update(column_arrays)
+    surfaces = adresses["surfaces"].to_numpy()
+    arrays["resume.surfaces.starts"] = np.concatenate([[0], np.cumsum([len(values) for values in surfaces])])
+    arrays["resume.surfaces.values"] = np.concatenate([np.empty(0, dtype=np.int64), *surfaces]).astype(np.int64)
+
+    prix = aggregates.prix
+    index = KeyIndex.build(prix["niveau"] + "|" + prix["cle"] + "|" + prix["type_local"])
+    arrays.update({"prix.keys": index.keys, "prix.starts": index.starts, "prix.positions": index.positions})
+    arrays["prix.periode_mois"] = prix["periode_mois"].to_numpy(dtype=np.int32)
+    arrays["prix.prix_m2_median"] = prix["prix_m2_median"].to_numpy(dtype=np.float64)
+    arrays["prix.nb_mutations"] = prix["nb_mutations"].to_numpy(dtype=np.int64)
+    return arrays, kinds
+
+
+def write_dvf_mmap(table_path, df, aggregates=None):
+    """
+    Écrit la table DVF `df` (lue depuis `table_path`) en colonnes à largeur fixe (_column_arrays),
+    un fichier .npy par tableau, avec ses index (adresse, parcelle, grille spatiale, surfaces,
+    trigrammes) et ses tables agrégées (`aggregates`, construites depuis `df` si absentes).
+    Chaque écriture crée un nouveau dossier de version, désigné ensuite par dvf_mmap_pointer :
+    les lecteurs voient l'ancienne version complète jusqu'au remplacement du pointeur.
+    Seules la nouvelle version et la précédente (encore ouverte par les process qui la lisent)
+    sont gardées. Renvoie le chemin du dossier.
+    """
+    signature = table_signature(table_path)
+    previous = dvf_mmap_path(table_path)
+    versions = _versions(table_path)
+    version = versions[-1] + 1 if versions else 1
+    target = _version_path(table_path, version)
+    os.makedirs(target)
+
+    arrays, kinds = {}, {}
+    for col in df.columns:
+        column_arrays, kinds[col] = _column_arrays(col, df[col])
+        arrays.update(column_arrays)
+        if col in INDEXED_COLUMNS:
+            arrays[f"{col}.starts"], arrays[f"{col}.order"] = _postings(arrays[f"{col}.codes"], len(arrays[f"{col}.keys"]))
+
+    grid = SpatialGrid.build(arrays["longitude"], arrays["latitude"], GRID_CELL_SIZE)
+    arrays.update({f"grid.{name}": getattr(grid, name) for name in ("cells", "starts", "order", "x", "y")})
+    surfaces = SurfaceIndex.build(df["code_postal"], df["code_type_local"], df["surface_reelle_bati"])
+    arrays.update({"surfaces.keys": surfaces.keys, "surfaces.order": surfaces.order})
+    # trigrammes des adresses dans l'ordre du dictionnaire : les ids sont les codes d'adresse
+    fuzzy = FuzzyAddressIndex.build(np.char.decode(arrays["adresse_complete.keys"], "utf-8").astype(object))
+    arrays.update({f"fuzzy.{name}": getattr(fuzzy, name) for name in ("keys", "starts", "ids", "sizes", "numeros")})
+    aggregate_arrays, resume = _aggregate_arrays(aggregates or DVFAggregates.build(df))
+    arrays.update(aggregate_arrays)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(target, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(target, "meta.json"), "w") as f:
+        json.dump({"rows": len(df), "columns": kinds, "resume": resume, "cell_size": GRID_CELL_SIZE,
+                   "table": signature}, f)
+
+    pointer = dvf_mmap_pointer(table_path)
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(os.path.basename(target))
+    os.replace(f"{pointer}.tmp", pointer)
+
+    # autres versions (plus anciennes, ou écritures interrompues), et dossier unique des versions sans pointeur
+    for old in versions:
+        if _version_path(table_path, old) != previous:
+            shutil.rmtree(_version_path(table_path, old), ignore_errors=True)
+    shutil.rmtree(f"{table_path}.mmap", ignore_errors=True)
+    return target
+
+
+class _DecodedKeys:
+    """
+    Vue texte d'un dictionnaire UTF-8 mappé : les valeurs sont décodées à la lecture.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        return self.keys[i].decode("utf-8")
+
+
+class DVFColumns:
+    """
+    Table DVF en colonnes mappées en mémoire (sortie de write_dvf_mmap), en lecture seule.
+    Les pages lues sont partagées entre process par le cache du système : un process
+    ne garde en propre que les lignes qu'il extrait (take).
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.path = path
+        self.rows = meta["rows"]
+        self.kinds = meta["columns"]
+        # types des colonnes du résumé par adresse (None : dossier écrit sans les tables agrégées)
+        self.resume_kinds = meta.get("resume")
+        self.cell_size = meta["cell_size"]
+        # signature de la table lue pour écrire ce dossier (table_signature)
+        self.table = meta.get("table")
+        self.arrays = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+
+    def __len__(self):
+        return self.rows
+
+    def take(self, positions, columns=None):
+        """
+        Lignes aux `positions` en DataFrame (index : positions), colonnes décodées.
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        data = {col: _decode(self.arrays, col, self.kinds[col], positions) for col in columns or self.kinds}
+        return pd.DataFrame(data, index=positions)
+
+    def key_index(self, column):
+        return KeyIndex(self.arrays[f"{column}.keys"], self.arrays[f"{column}.starts"],
+                        self.arrays[f"{column}.order"], self.rows)
+
+    def spatial_grid(self):
+        return SpatialGrid(self.cell_size, *(self.arrays[f"grid.{name}"] for name in ("cells", "starts", "order", "x", "y")),
+                           self.rows)
+
+    def surface_index(self):
+        return SurfaceIndex(self.arrays["surfaces.keys"], self.arrays["surfaces.order"], self.rows)
+
+    def fuzzy_index(self):
+        return FuzzyAddressIndex(_DecodedKeys(self.arrays["adresse_complete.keys"]),
+                                 *(self.arrays[f"fuzzy.{name}"] for name in ("keys", "starts", "ids", "sizes", "numeros")))
+
+    def aggregates(self):
+        """
+        Tables agrégées mappées, ou None si le dossier a été écrit sans elles.
+        """
+        return MappedAggregates(self) if self.resume_kinds is not None else None
+
+
+class MappedAggregates:
+    """
+    Tables agrégées lues dans les colonnes mappées : mêmes méthodes que DVFAggregates,
+    seules les lignes demandées sont lues et décodées.
+    """
+
+    def __init__(self, columns):
+        self.rows = columns.rows
+        self._arrays = columns.arrays
+        self._kinds = columns.resume_kinds
+        self._adresses = columns.arrays["resume.adresse"]
+        self._prix = KeyIndex(columns.arrays["prix.keys"], columns.arrays["prix.starts"],
+                              columns.arrays["prix.positions"], len(columns.arrays["prix.periode_mois"]))
+
+    def adresse(self, adresse_complete):
+        """
+        Résumé de l'adresse (dict), ou None si elle n'a aucune mutation.
+        """
+        encoded = str(adresse_complete).encode("utf-8")
+        slot = np.searchsorted(self._adresses, encoded)
+        if slot == len(self._adresses) or self._adresses[slot] != encoded:
+            return None
+        position = np.array([slot])
+        resume = {col: _decode(self._arrays, f"resume.{col}", kind, position)[0] for col, kind in self._kinds.items()}
+        resume = {col: value.item() if isinstance(value, np.generic) else value for col, value in resume.items()}
+        starts = self._arrays["resume.surfaces.starts"]
+        resume["surfaces"] = self._arrays["resume.surfaces.values"][starts[slot]:starts[slot + 1]].tolist()
+        return resume
+
+    def prix_m2(self, niveau, cle, type_local=TOUS_TYPES):
+        """
+        Prix médian au m² et nombre de mutations de chaque période pour la commune
+        ou la voie `cle` (table vide si inconnue).
+        """
+        positions = self._prix.get(f"{niveau}|{cle}|{type_local}")
+        return pd.DataFrame({
+            "periode_mois": self._arrays["prix.periode_mois"][positions].astype(np.int64),
+            "prix_m2_median": self._arrays["prix.prix_m2_median"][positions],
+            "nb_mutations": self._arrays["prix.nb_mutations"][positions],
+        })
@@ -0,0 +1,136 @@
+import json
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from utils import DPE_FIELDS, DVF_FIELDS
+
+
+# Type Python de chaque champ de la fiche (str pour les champs absents)
+FIELD_TYPES = {
+    'surface_reelle_bati': int,
+    'nombre_pieces_principales': int,
+    'surface_terrain': int,
+    'annee_construction': int,
+    'nombre_niveau_logement': int,
+    'conso_5 usages_par_m2_ef': float,
+    'conso_5_usages_par_m2_ep': float,
+    'emission_ges_5_usages par_m2': float,
+    'surface_habitable_logement': float,
+}
+
+SOURCES = (("DVF", DVF_FIELDS), ("DPE", DPE_FIELDS))
+
+
+def _manquant(valeur):
+    return valeur is None or valeur is pd.NA or (isinstance(valeur, float) and valeur != valeur)
+
+
+def _typer(valeur, type_):
+    if type_ is int and isinstance(valeur, float) and not valeur.is_integer():
+        return valeur
+    try:
+        return type_(valeur)
+    except (TypeError, ValueError):
+        return valeur
+
+
+def valeurs_distinctes(df, col):
+    """
+    Valeurs non vides de la colonne `col` de `df`, sans doublon, dans l'ordre des lignes,
+    converties au type Python du champ (liste vide si la colonne est absente).
+    """
+    if col not in df.columns:
+        return []
+    type_ = FIELD_TYPES.get(col, str)
+    return list(dict.fromkeys(_typer(v, type_) for v in df[col].tolist() if not _manquant(v)))
+
+
+@dataclass(slots=True)
+class Champ:
+    """
+    Un champ de la fiche : valeurs candidates trouvées dans sa source, et la valeur
+    choisie par l'utilisateur quand il y en a plusieurs.
+    """
+    nom: str
+    source: str
+    candidats: list = field(default_factory=list)
+    choix: object = None
+
+    @property
+    def valeur(self):
+        """
+        Valeur unique, valeur choisie, liste des candidats si aucun choix n'est fait, ou None.
+        """
+        if len(self.candidats) == 1:
+            return self.candidats[0]
+        if self.choix is not None:
+            return self.choix
+        return list(self.candidats) or None
+
+    @property
+    def a_choisir(self):
+        return len(self.candidats) > 1
+
+
+@dataclass(slots=True)
+class FicheBien:
+    """
+    Fiche de bien : un Champ par champ de DVF_FIELDS et DPE_FIELDS, dans cet ordre.
+    Construite directement depuis les lignes DVF et DPE retenues ; la conversion en
+    dict, JSON, ligne de CSV ou DataFrame ne se fait qu'à l'affichage ou à l'écriture.
+    """
+    champs: dict
+
+    @classmethod
+    def from_frames(cls, df_dvf, df_dpe):
+        champs = {}
+        for (source, fields), df in zip(SOURCES, (df_dvf, df_dpe)):
+            for col in fields:
+                champs[col] = Champ(col, source, valeurs_distinctes(df, col))
+        return cls(champs)
+
+    def __getitem__(self, nom):
+        return self.champs[nom]
+
+    def __iter__(self):
+        return iter(self.champs.values())
+
+    def choisir(self, nom, valeur):
+        self.champs[nom].choix = valeur
+
+    def champs_source(self, source):
+        """
+        Noms des champs remplis par `source` ("DVF" ou "DPE").
+        """
+        return [champ.nom for champ in self if champ.source == source]
+
+    def to_dict(self):
+        """
+        {champ: {"valeur": valeur, "source": "DVF"/"DPE"}}
+        """
+        return {champ.nom: {"valeur": champ.valeur, "source": champ.source} for champ in self}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=str, **kwargs)
+
+    def to_row(self):
+        """
+        Fiche à plat (une colonne de valeur et une de source par champ), pour un CSV :
+        une liste de valeurs candidates est écrite en JSON.
+        """
+        row = {}
+        for champ in self:
+            valeur = champ.valeur
+            row[champ.nom] = json.dumps(valeur, ensure_ascii=False, default=str) if isinstance(valeur, list) else valeur
+            row[f"{champ.nom} (source de donnée)"] = champ.source
+        return row
+
+    def to_frame(self):
+        """
+        Fiche en DataFrame vertical (un champ par ligne), pour l'affichage.
+        """
+        return pd.DataFrame(
+            [(champ.nom, champ.valeur, champ.source) for champ in self],
+            columns=["champ à remplir", "valeur", "source de donnée"]
+        )
@@ -0,0 +1,152 @@
+import os
+import re
+
+import numpy as np
+
+from key_index import merge_postings
+
+
+# Alphabet des adresses normalisées (normalize_address) : espace, chiffres, lettres
+_ALPHABET = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_BASE = len(_ALPHABET)
+_TRIGRAMS = _BASE ** 3
+_CODES = np.zeros(256, dtype=np.int64)
+_CODES[np.frombuffer(_ALPHABET.encode(), dtype=np.uint8)] = np.arange(_BASE)
+
+# code postal : 4 chiffres quand le zéro initial a été perdu (colonne numérique des DVF)
+_CODE_POSTAL = re.compile(r"\b(\d{4,5})\b")
+_NUMERO = re.compile(r"^(\d+)\b")
+
+
+def _trigrams(addresses):
+    """
+    Trigrammes de chaque adresse (entourée d'un espace) : (codes, numéro de l'adresse).
+    """
+    padded = [f" {adresse} " for adresse in addresses]
+    lengths = np.fromiter(map(len, padded), dtype=np.int64, count=len(padded))
+    chars = _CODES[np.frombuffer("".join(padded).encode("ascii", "replace"), dtype=np.uint8)]
+    owner = np.repeat(np.arange(len(padded)), lengths)
+    codes = (chars[:-2] * _BASE + chars[1:-1]) * _BASE + chars[2:]
+    # un trigramme ne doit pas chevaucher deux adresses
+    valid = owner[:-2] == owner[2:]
+    return codes[valid], owner[:-2][valid]
+
+
+def _code_postal(adresse):
+    found = _CODE_POSTAL.findall(adresse)
+    return int(found[-1]) if found else 0
+
+
+def _numero(adresse):
+    match = _NUMERO.match(adresse)
+    return int(match.group(1)) if match else -1
+
+
+class FuzzyAddressIndex:
+    """
+    Index approché sur des adresses normalisées : listes inversées de trigrammes,
+    séparées par code postal. Une recherche ne lit que les listes des trigrammes
+    de la requête dans son code postal, et classe les adresses par coefficient de Dice.
+    """
+
+    def __init__(self, addresses, keys, starts, ids, sizes, numeros):
+        self.addresses = addresses  # adresses indexées (les ids renvoient à ce tableau)
+        self.keys = keys            # (code postal, trigramme) présents, triés
+        self.starts = starts        # début de chaque liste dans `ids` (+ fin de la dernière)
+        self.ids = ids              # adresses contenant chaque trigramme, rangées par clé
+        self.sizes = sizes          # nombre de trigrammes distincts de chaque adresse
+        self.numeros = numeros      # numéro de voie en tête d'adresse (-1 si absent)
+
+    @classmethod
+    def build(cls, addresses):
+        addresses = np.asarray(addresses, dtype=object)
+        n = max(len(addresses), 1)
+        codes, owner = _trigrams(addresses)
+        blocks = np.fromiter(map(_code_postal, addresses), dtype=np.int64, count=len(addresses))
+        # couples (clé, adresse) distincts, triés par clé (tri puis comparaison au voisin,
+        # bien plus rapide que np.unique sur des dizaines de millions de valeurs)
+        pairs = np.sort((blocks[owner] * _TRIGRAMS + codes) * n + owner)
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        keys, ids = pairs // n, (pairs % n).astype(np.int32)
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        keys = keys[starts]
+        starts = np.append(starts, len(ids))
+        sizes = np.bincount(ids, minlength=len(addresses)).astype(np.int32)
+        numeros = np.fromiter(map(_numero, addresses), dtype=np.int64, count=len(addresses))
+        return cls(addresses, keys, starts, ids, sizes, numeros)
+
+    def extend(self, addresses):
+        """
+        Index étendu aux nouvelles adresses `addresses` (absentes de l'index),
+        sans réindexer les adresses existantes.
+        """
+        new = FuzzyAddressIndex.build(addresses)
+        keys, starts, insert_at = merge_postings(self.keys, self.starts, new.keys, new.starts)
+        ids = np.insert(self.ids, insert_at, new.ids + np.int32(len(self)))
+        return FuzzyAddressIndex(
+            np.concatenate([self.addresses, new.addresses]), keys, starts, ids,
+            np.concatenate([self.sizes, new.sizes]), np.concatenate([self.numeros, new.numeros])
+        )
+
+    def save(self, path):
+        # les adresses ne sont pas enregistrées : elles sont relues dans la table
+        np.savez(path, keys=self.keys, starts=self.starts, ids=self.ids,
+                 sizes=self.sizes, numeros=self.numeros)
+
+    @classmethod
+    def load(cls, path, addresses):
+        data = np.load(path)
+        return cls(np.asarray(addresses, dtype=object), data["keys"], data["starts"],
+                   data["ids"], data["sizes"], data["numeros"])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def search(self, query, k=5, code_postal=None):
+        """
+        Les `k` adresses les plus proches de `query` (déjà normalisée), dans le code postal
+        donné ou, à défaut, celui de la requête : liste de (adresse, score entre 0 et 1).
+        Si la requête commence par un numéro, seules les adresses au même numéro sont gardées.
+        """
+        block = int(code_postal) if code_postal else _code_postal(query)
+        codes = np.unique(_trigrams([query])[0])
+        wanted = block * _TRIGRAMS + codes
+        slots = np.searchsorted(self.keys, wanted)
+        found = slots < len(self.keys)
+        slots = slots[found][self.keys[slots[found]] == wanted[found]]
+        if len(slots) == 0:
+            return []
+        hits = np.concatenate([self.ids[self.starts[s]:self.starts[s + 1]] for s in slots])
+        candidates, common = np.unique(hits, return_counts=True)
+        numero = _numero(query)
+        if numero >= 0:
+            keep = self.numeros[candidates] == numero
+            candidates, common = candidates[keep], common[keep]
+        scores = 2 * common / (len(codes) + self.sizes[candidates])
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(self.addresses[candidates[i]], float(scores[i])) for i in best]
+
+
+def fuzzy_index_path(table_path):
+    """
+    Fichier de l'index d'adresses rangé à côté de la table.
+    """
+    return f"{table_path}.fuzzy.npz"
+
+
+def load_or_build_fuzzy_index(table_path, addresses):
+    """
+    Charge l'index d'adresses de la table s'il est à jour, sinon le reconstruit
+    et essaie de l'enregistrer à côté de la table.
+    """
+    path = fuzzy_index_path(table_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(table_path):
+        index = FuzzyAddressIndex.load(path, addresses)
+        if len(index) == len(addresses):
+            return index
+    index = FuzzyAddressIndex.build(addresses)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
@@ -0,0 +1,256 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import DecodeError, HTTPError as URLLib3Error, ProtocolError
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+
+
+# Délais (connexion, lecture) par hôte, en secondes
+HOST_TIMEOUTS = {
+    "api-adresse.data.gouv.fr": (3.05, 5),
+    "data.geopf.fr": (3.05, 5),
+    "data.ademe.fr": (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Débit maximal par hôte, en requêtes par seconde (limites publiées par les API)
+HOST_RATE_LIMITS = {
+    "api-adresse.data.gouv.fr": 50,
+    "data.geopf.fr": 50,
+    "data.ademe.fr": 10,
+}
+
+# Part du débit de chaque hôte ouverte aux requêtes spéculatives (enrichissement anticipé)
+SPECULATIVE_SHARE = 0.2
+
+# Vrai dans un bloc speculative() : suit les tâches lancées avec copy_context
+_speculative = contextvars.ContextVar("speculative", default=False)
+
+
+class SpeculativeRequestSkipped(requests.exceptions.RequestException):
+    """
+    Requête spéculative abandonnée : le débit partagé de l'hôte n'a pas de jeton libre.
+    """
+
+
+@contextmanager
+def speculative():
+    """
+    Marque les requêtes du bloc comme spéculatives : elles ont un débit propre
+    (SPECULATIVE_SHARE du débit de l'hôte) et ne prennent un jeton du débit partagé
+    que s'il est libre. Elles n'attendent jamais : sans jeton, SpeculativeRequestSkipped est levée.
+    Les requêtes des adresses validées ne font jamais la queue derrière elles.
+    """
+    token = _speculative.set(True)
+    try:
+        yield
+    finally:
+        _speculative.reset(token)
+
+
+def default_retry():
+    """
+    Nouvelles tentatives bornées, avec attente exponentielle, sur les erreurs
+    de connexion et les réponses 429/5xx (en respectant Retry-After).
+    """
+    return Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+
+
+def _as_request_exception(error):
+    # mêmes correspondances que requests à la lecture du corps (Response.iter_content)
+    if isinstance(error, ProtocolError):
+        return requests.exceptions.ChunkedEncodingError(error)
+    if isinstance(error, DecodeError):
+        return requests.exceptions.ContentDecodingError(error)
+    return requests.exceptions.ConnectionError(error)
+
+
+class RateLimiter:
+    """
+    Seau à jetons partagé entre threads : au plus `rate` requêtes par seconde.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        # sous verrou : jetons accumulés depuis la dernière mise à jour
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """
+        Prend un jeton s'il y en a un de libre, sans attendre ; renvoie vrai si c'est le cas.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def release(self):
+        """
+        Rend un jeton pris pour une requête finalement non envoyée.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class HTTPClient:
+    """
+    Client HTTP partagé par les appels aux API : connexions persistantes
+    (un pool par hôte), nouvelles tentatives sur 429/5xx, délai et débit maximal
+    propres à chaque hôte, plus un débit réduit pour les requêtes spéculatives.
+    """
+
+    def __init__(self, timeouts=None, retry=None, pool_maxsize=32, rate_limits=None):
+        self.timeouts = {**HOST_TIMEOUTS, **(timeouts or {})}
+        self.rate_limiters = {
+            host: RateLimiter(rate)
+            for host, rate in {**HOST_RATE_LIMITS, **(rate_limits or {})}.items()
+            if rate
+        }
+        self.speculative_limiters = {
+            host: RateLimiter(limiter.rate * SPECULATIVE_SHARE)
+            for host, limiter in self.rate_limiters.items()
+        }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.timeouts),
+            pool_maxsize=pool_maxsize,
+            max_retries=retry or default_retry()
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def mount(self, prefix, adapter):
+        """
+        Branche un autre transport (HTTPAdapter) pour les URL qui commencent par `prefix`.
+        """
+        self.session.mount(prefix, adapter)
+
+    def timeout_for(self, url):
+        return self.timeouts.get(urlsplit(url).hostname, DEFAULT_TIMEOUT)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout_for(url))
+        host = urlsplit(url).hostname
+        limiter = self.rate_limiters.get(host)
+        if limiter is not None and _speculative.get():
+            # pas d'attente : une requête spéculative en retard ne sert plus à rien.
+            # Le jeton spéculatif n'est pris qu'une fois le débit partagé accordé,
+            # et le jeton partagé est rendu si la part spéculative est épuisée
+            if not limiter.try_acquire():
+                raise SpeculativeRequestSkipped(f"débit de {host} réservé aux requêtes validées")
+            if not self.speculative_limiters[host].try_acquire():
+                limiter.release()
+                raise SpeculativeRequestSkipped(f"débit de {host} réservé aux requêtes validées")
+        elif limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.record_api(host, time.perf_counter() - start, error=True)
+            raise
+        # en streaming le corps n'est pas encore lu : seule la durée jusqu'aux en-têtes est comptée,
+        # ses octets le sont par stream()
+        received = 0 if kwargs.get("stream") else len(response.content)
+        metrics.record_api(host, time.perf_counter() - start, received, error=response.status_code >= 400)
+        return response
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        """
+        Réponse dont le corps est lu au fil de l'eau (response.raw) dans le bloc, puis fermée.
+        Les octets lus sont comptés à la sortie du bloc ; une coupure pendant la lecture
+        (erreurs urllib3 : connexion interrompue, délai dépassé) est levée en RequestException.
+        """
+        response = self.request(method, url, stream=True, **kwargs)
+        error = False
+        try:
+            with response:
+                yield response
+        except URLLib3Error as e:
+            error = True
+            raise _as_request_exception(e) from e
+        finally:
+            metrics.record_api_body(urlsplit(url).hostname, response.raw.tell(), error)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class LocalStubAdapter(HTTPAdapter):
+    """
+    Transport qui envoie les requêtes vers un serveur local (bouchon de test)
+    en conservant le chemin et les paramètres de l'URL d'origine.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        kwargs.setdefault("max_retries", default_retry())
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = self.base_url + parts.path + (f"?{parts.query}" if parts.query else "")
+        return super().send(request, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Renvoie le client HTTP partagé par tout le process (créé au premier appel).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+def set_client(client):
+    """
+    Remplace le client partagé (tests, bancs d'essai).
+    """
+    global _client
+    with _client_lock:
+        _client = client
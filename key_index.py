@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def merge_postings(keys, starts, new_keys, new_starts):
+    """
+    Fusionne deux listes inversées triées (valeurs distinctes `keys`, débuts `starts`).
+    Renvoie les valeurs et débuts fusionnés, et les indices où insérer (np.insert)
+    les éléments de la nouvelle liste dans l'ancienne : pour une même valeur,
+    les nouveaux éléments viennent après les anciens.
+    """
+    keys = keys.astype(np.result_type(keys, new_keys))
+    slots = np.searchsorted(keys, new_keys)
+    present = np.zeros(len(new_keys), dtype=bool)
+    inside = slots < len(keys)
+    present[inside] = keys[slots[inside]] == new_keys[inside]
+    new_counts = np.diff(new_starts)
+    insert_at = np.repeat(starts[np.searchsorted(keys, new_keys, side="right")], new_counts)
+    merged_keys = np.insert(keys, slots[~present], new_keys[~present])
+    counts = np.insert(np.diff(starts), slots[~present], 0)
+    counts[np.searchsorted(merged_keys, new_keys)] += new_counts
+    return merged_keys, np.concatenate([[0], np.cumsum(counts)]), insert_at
+
+
+class KeyIndex:
+    """
+    Index d'une colonne de table : valeur -> positions des lignes.
+    Les valeurs distinctes sont triées (encodées en UTF-8, ce qui conserve l'ordre)
+    et les positions rangées par valeur : une recherche est une recherche dichotomique
+    suivie d'une tranche, sans rien reconstruire au chargement.
+    """
+
+    def __init__(self, keys, starts, positions, rows):
+        self.keys = keys            # valeurs distinctes, triées
+        self.starts = starts        # début de chaque valeur dans `positions` (+ fin de la dernière)
+        self.positions = positions  # positions des lignes, rangées par valeur
+        self.rows = rows            # nombre de lignes de la table indexée
+
+    @classmethod
+    def build(cls, values):
+        values = pd.Series(values)
+        codes, uniques = pd.factorize(values, sort=True)
+        order = np.argsort(codes, kind="stable")
+        # les valeurs manquantes (code -1) ne sont pas indexées
+        order = order[codes[order] >= 0]
+        counts = np.bincount(codes[order], minlength=len(uniques))
+        starts = np.concatenate([[0], np.cumsum(counts)])
+        keys = np.char.encode(np.asarray(uniques, dtype=str), "utf-8")
+        return cls(keys, starts, order, len(values))
+
+    def extend(self, values):
+        """
+        Index étendu aux lignes `values` ajoutées à la fin de la table, sans réindexer l'existant.
+        """
+        new = KeyIndex.build(values)
+        keys, starts, insert_at = merge_postings(self.keys, self.starts, new.keys, new.starts)
+        positions = np.insert(self.positions, insert_at, new.positions + self.rows)
+        return KeyIndex(keys, starts, positions, self.rows + new.rows)
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, starts=self.starts, positions=self.positions, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["keys"], data["starts"], data["positions"], int(data["rows"]))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        """
+        Positions des lignes dont la colonne vaut `key` (tableau vide si la valeur est absente).
+        """
+        encoded = str(key).encode("utf-8")
+        slot = np.searchsorted(self.keys, encoded)
+        if slot == len(self.keys) or self.keys[slot] != encoded:
+            return np.empty(0, dtype=np.intp)
+        return self.positions[self.starts[slot]:self.starts[slot + 1]]
+
+
+def key_index_path(table_path, column):
+    """
+    Fichier de l'index de `column` rangé à côté de la table.
+    """
+    return f"{table_path}.{column}.npz"
+
+
+def load_or_build_key_index(table_path, column, values):
+    """
+    Charge l'index de la colonne s'il est à jour, sinon le reconstruit
+    et essaie de l'enregistrer à côté de la table.
+    """
+    path = key_index_path(table_path, column)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(table_path):
+        index = KeyIndex.load(path)
+        if index.rows == len(values):
+            return index
+    index = KeyIndex.build(values)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
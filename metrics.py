@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+logger = logging.getLogger("fiche_de_bien")
+
+# Nombre de durées récentes gardées par étape pour les percentiles
+RECENT_DURATIONS = 1000
+
+
+class Metrics:
+    """
+    Compteurs du process : pour chaque étape du pipeline (durée, appels, erreurs)
+    et chaque API externe (requêtes, durée, octets reçus, erreurs), plus les
+    succès/échecs des caches enregistrés. Exportables au format texte Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}   # étape -> {"calls", "errors", "seconds", "recent"}
+        self.apis = {}     # hôte -> {"requests", "errors", "seconds", "bytes"}
+        self.caches = {}   # nom -> cache (TieredCache)
+
+    def record_stage(self, name, seconds, error=False):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {"calls": 0, "errors": 0, "seconds": 0.0, "recent": deque(maxlen=RECENT_DURATIONS)}
+            )
+            stage["calls"] += 1
+            stage["errors"] += int(error)
+            stage["seconds"] += seconds
+            stage["recent"].append(seconds)
+
+    def record_api(self, host, seconds, received=0, error=False):
+        with self._lock:
+            api = self.apis.setdefault(host, {"requests": 0, "errors": 0, "seconds": 0.0, "bytes": 0})
+            api["requests"] += 1
+            api["errors"] += int(error)
+            api["seconds"] += seconds
+            api["bytes"] += received
+
+    def record_api_body(self, host, received, error=False):
+        """
+        Corps d'une réponse lue en streaming : octets reçus, et une erreur si la lecture
+        a été interrompue (la requête elle-même est déjà comptée par record_api).
+        """
+        with self._lock:
+            api = self.apis.setdefault(host, {"requests": 0, "errors": 0, "seconds": 0.0, "bytes": 0})
+            api["errors"] += int(error)
+            api["bytes"] += received
+
+    def register_cache(self, cache):
+        with self._lock:
+            self.caches[cache.name] = cache
+
+    @contextmanager
+    def stage(self, name, timings=None):
+        """
+        Chronomètre le bloc comme l'étape `name` ; la durée est aussi notée
+        dans `timings` (dict des durées d'une requête) s'il est fourni.
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.record_stage(name, seconds, error)
+            if timings is not None:
+                timings[name] = seconds
+
+    def timed(self, name, timings, function, *args, **kwargs):
+        """
+        Appelle `function` en la chronométrant comme l'étape `name` (pour les threads du pipeline).
+        """
+        with self.stage(name, timings):
+            return function(*args, **kwargs)
+
+    def snapshot(self):
+        """
+        État des compteurs : {"stages", "apis", "caches"}, avec p50/p95 des durées récentes par étape.
+        """
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                recent = np.fromiter(stage["recent"], dtype=float)
+                stages[name] = {
+                    "calls": stage["calls"],
+                    "errors": stage["errors"],
+                    "seconds": stage["seconds"],
+                    "p50": float(np.percentile(recent, 50)) if len(recent) else None,
+                    "p95": float(np.percentile(recent, 95)) if len(recent) else None,
+                }
+            apis = {host: dict(api) for host, api in self.apis.items()}
+            caches = dict(self.caches)
+        return {"stages": stages, "apis": apis, "caches": {name: cache.stats() for name, cache in caches.items()}}
+
+    def prometheus_text(self):
+        """
+        Compteurs au format texte d'exposition Prometheus.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        stages, apis, caches = snapshot["stages"], snapshot["apis"], snapshot["caches"]
+        metric("fiche_stage_calls_total", "counter", "Exécutions de l'étape.",
+               [({"stage": n}, s["calls"]) for n, s in stages.items()])
+        metric("fiche_stage_errors_total", "counter", "Exécutions de l'étape en erreur.",
+               [({"stage": n}, s["errors"]) for n, s in stages.items()])
+        metric("fiche_stage_duration_seconds_total", "counter", "Durée cumulée de l'étape.",
+               [({"stage": n}, s["seconds"]) for n, s in stages.items()])
+        metric("fiche_stage_duration_seconds", "summary", "Durées récentes de l'étape.",
+               [({"stage": n, "quantile": q}, s[key])
+                for n, s in stages.items() if s["p50"] is not None
+                for q, key in (("0.5", "p50"), ("0.95", "p95"))])
+        metric("fiche_api_requests_total", "counter", "Requêtes HTTP envoyées à l'API.",
+               [({"host": h}, a["requests"]) for h, a in apis.items()])
+        metric("fiche_api_errors_total", "counter", "Requêtes en erreur (exception ou statut >= 400).",
+               [({"host": h}, a["errors"]) for h, a in apis.items()])
+        metric("fiche_api_duration_seconds_total", "counter", "Durée cumulée des requêtes.",
+               [({"host": h}, a["seconds"]) for h, a in apis.items()])
+        metric("fiche_api_received_bytes_total", "counter", "Octets reçus de l'API.",
+               [({"host": h}, a["bytes"]) for h, a in apis.items()])
+        metric("fiche_cache_hits_total", "counter", "Succès du cache, par niveau.",
+               [({"cache": n, "level": level}, c[f"{level}_hits"])
+                for n, c in caches.items() for level in ("memory", "disk")])
+        metric("fiche_cache_misses_total", "counter", "Échecs du cache.",
+               [({"cache": n}, c["misses"]) for n, c in caches.items()])
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.apis.clear()
+        for cache in list(self.caches.values()):
+            cache.counters.update({key: 0 for key in cache.counters})
+
+
+metrics = Metrics()
+
+
+def log_event(event, **fields):
+    """
+    Écrit un événement en une ligne JSON dans le logger de l'app.
+    """
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    """
+    Sert les compteurs au format Prometheus sur `port` (par défaut la variable
+    d'environnement METRICS_PORT), dans un thread du process ; une seule fois par process.
+    Renvoie le serveur, ou None si aucun port n'est configuré.
+    """
+    global _server
+    port = port or os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+            except OSError as e:
+                # port déjà pris (autre process de l'app) : l'app fonctionne sans export
+                logger.warning("export des métriques impossible sur le port %s : %s", port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+        return _server
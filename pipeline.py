@@ -0,0 +1,153 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import pandas as pd
+
+from metrics import log_event, metrics
+from store import get_dvf_store
+from utils import (
+    get_coordinates_from_address,
+    get_id_cadastre_from_coordinates,
+    get_dpe_exact_coordinates,
+    normalize_address
+)
+
+
+# Délai maximal par source et pour l'ensemble des sources, en secondes
+SOURCE_DEADLINES = {"cadastre": 5, "dpe": 10, "dvf": 5}
+OVERALL_DEADLINE = 12
+
+# Score minimal (coefficient de Dice sur les trigrammes) pour accepter une adresse DVF approchée
+DVF_FUZZY_MIN_SCORE = 0.8
+
+# Rayon de recherche des mutations DVF autour du point BAN quand l'adresse exacte est inconnue (mètres)
+DVF_SPATIAL_RADIUS = 20
+
+# Threads partagés par toutes les sessions : les appels attendent surtout le réseau
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="enrichissement")
+
+
+def _submit(fn, *args):
+    # la tâche garde le contexte de l'appelant (requêtes spéculatives de l'anticipation)
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def get_dvf_from_coordinates(coords, id_parcelles=None):
+    """
+    Mutations DVF dont l'adresse correspond exactement au libellé BAN ; à défaut,
+    celles de la parcelle sous le point BAN (colonne parcelle_ban) ;
+    à défaut, celles de l'adresse DVF la plus proche du libellé (colonne score_adresse) ;
+    à défaut, mutations à moins de DVF_SPATIAL_RADIUS mètres du point BAN (colonne distance_m).
+    `id_parcelles` est la liste des parcelles du cadastre, ou une fonction qui la renvoie,
+    appelée seulement si l'adresse exacte est absente.
+    """
+    dvf_store = get_dvf_store()
+    adresse = normalize_address(coords["adresse_label"])
+    df_dvf = dvf_store.lookup_adresse(adresse)
+    if df_dvf.empty:
+        if callable(id_parcelles):
+            id_parcelles = id_parcelles()
+        if id_parcelles:
+            # parcelles triées par distance au point : la première est celle du bâtiment
+            df_dvf = dvf_store.lookup_parcelle(id_parcelles[0]).copy()
+            df_dvf["parcelle_ban"] = id_parcelles[0]
+    if df_dvf.empty:
+        df_dvf = dvf_store.lookup_adresse_fuzzy(adresse, coords.get("code_postal"), DVF_FUZZY_MIN_SCORE)
+    if df_dvf.empty:
+        df_dvf = dvf_store.lookup_around(coords["longitude"], coords["latitude"], DVF_SPATIAL_RADIUS)
+    return df_dvf
+
+
+def _cadastre_parcelles(future, timeout):
+    """
+    Parcelles renvoyées par l'appel cadastre en cours, attendues au plus `timeout` secondes
+    (None si l'appel échoue ou n'aboutit pas à temps).
+    """
+    try:
+        return future.result(timeout=max(timeout, 0)).get("id_parcelles")
+    except Exception:
+        return None
+
+
+def _returned_error(value):
+    """
+    Erreur qu'une source signale dans sa valeur de retour plutôt qu'en levant une exception
+    (clé "error" d'un dict, colonne "error" d'un DataFrame), ou None.
+    """
+    if isinstance(value, pd.DataFrame):
+        return str(value["error"].iloc[0]) if "error" in value.columns and len(value) else None
+    if isinstance(value, dict):
+        return value.get("error")
+    return None
+
+
+def _default_result(source, error):
+    if source == "cadastre":
+        return {"error": error}
+    return pd.DataFrame()
+
+
+def enrich_address(adresse, token, deadlines=None, overall_deadline=OVERALL_DEADLINE, coords=None):
+    """
+    Géocode l'adresse via la BAN, puis interroge en parallèle le cadastre,
+    l'API DPE et la table DVF (jointe par parcelle si l'adresse exacte est absente).
+    Renvoie un dict {"coords", "cadastre", "dpe", "dvf", "errors", "timings"} : une source
+    en erreur ou hors délai est remplacée par un résultat vide et signalée dans "errors" ;
+    "timings" donne la durée de chaque étape en secondes.
+    `coords` (résultat de géocodage déjà obtenu, par exemple en masse) évite l'appel à la BAN.
+    """
+    deadlines = {**SOURCE_DEADLINES, **(deadlines or {})}
+    timings = {}
+    with metrics.stage("enrichissement", timings):
+        result = _enrich_address(adresse, token, deadlines, overall_deadline, timings, coords)
+    # copie : une source hors délai peut encore noter sa durée depuis son thread
+    result["timings"] = timings = dict(timings)
+    log_event("enrichissement", adresse=adresse, timings=timings, errors=result["errors"])
+    return result
+
+
+def _enrich_address(adresse, token, deadlines, overall_deadline, timings, coords=None):
+    if coords is None:
+        coords = metrics.timed("geocodage", timings, get_coordinates_from_address, adresse)
+    if "error" in coords:
+        return {"coords": coords, "errors": {"geocodage": coords["error"]}}
+
+    start = time.monotonic()
+    cadastre = _submit(
+        metrics.timed, "cadastre", timings,
+        get_id_cadastre_from_coordinates, coords["longitude"], coords["latitude"]
+    )
+    cadastre_deadline = start + min(deadlines["cadastre"], overall_deadline)
+    futures = {
+        "cadastre": cadastre,
+        "dpe": _submit(
+            metrics.timed, "dpe", timings,
+            get_dpe_exact_coordinates, coords["coord_geo_x"], coords["coord_geo_y"], token
+        ),
+        # la jointure DVF par parcelle réutilise l'appel cadastre déjà lancé
+        "dvf": _submit(
+            metrics.timed, "dvf", timings,
+            get_dvf_from_coordinates, coords,
+            lambda: _cadastre_parcelles(cadastre, cadastre_deadline - time.monotonic())
+        )
+    }
+
+    result = {"coords": coords, "errors": {}}
+    for source, future in futures.items():
+        remaining = start + min(deadlines[source], overall_deadline) - time.monotonic()
+        try:
+            result[source] = future.result(timeout=max(remaining, 0))
+            error = _returned_error(result[source])
+            if error is not None:
+                result["errors"][source] = error
+                result[source] = _default_result(source, error)
+        except TimeoutError:
+            # le thread finit en arrière-plan, son résultat est ignoré
+            future.cancel()
+            result["errors"][source] = "délai dépassé"
+            result[source] = _default_result(source, "délai dépassé")
+        except Exception as e:
+            result["errors"][source] = str(e)
+            result[source] = _default_result(source, str(e))
+    return result
@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import speculative
+from metrics import log_event, metrics
+from pipeline import OVERALL_DEADLINE, enrich_address
+from utils import geocode_cache_key, get_address_suggestions
+
+
+# Nombre d'adresses suggérées enrichies par avance pendant la saisie
+PREFETCH_CANDIDATES = 3
+
+# Attente avant de lancer un enrichissement anticipé (secondes) : une suggestion
+# dépassée entre-temps par la saisie ne consomme aucune requête
+PREFETCH_DELAY = 0.2
+
+# Threads des enrichissements anticipés, séparés de ceux du pipeline :
+# le travail spéculatif ne retarde pas les adresses validées
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="anticipation")
+
+
+class Prefetcher:
+    """
+    Enrichissement anticipé d'une session pendant la saisie de l'adresse :
+    à chaque saisie partielle, les premières suggestions de l'autocomplétion BAN
+    sont enrichies en arrière-plan (géocodage, cadastre, DPE, DVF), ce qui remplit
+    aussi les caches partagés. Quand la saisie change, les enrichissements pas encore
+    commencés des anciennes suggestions sont annulés ; ceux déjà lancés finissent
+    mais leur résultat est abandonné.
+    Chaque enrichissement attend PREFETCH_DELAY avant de commencer, et ses requêtes
+    sont spéculatives : elles ne prennent que les jetons libres du débit de chaque API,
+    dans la limite d'une part de ce débit.
+    """
+
+    def __init__(self, token, candidates=PREFETCH_CANDIDATES):
+        self.token = token
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._saisie = None
+        self._generation = 0
+        self._suggestions = []
+        self._futures = {}  # clé de géocodage de la suggestion -> Future de enrich_address
+
+    def update(self, saisie):
+        """
+        Suggestions BAN (dicts au format de get_coordinates_from_address) pour la saisie
+        en cours, dont les `candidates` premières sont enrichies en arrière-plan.
+        """
+        saisie = saisie.strip()
+        with self._lock:
+            if saisie == self._saisie:
+                return list(self._suggestions)
+            self._generation += 1
+            generation = self._generation
+            self._saisie = saisie
+        suggestions = get_address_suggestions(saisie)
+        with self._lock:
+            if generation != self._generation:
+                # saisie modifiée pendant l'appel à la BAN : la nouvelle saisie décide
+                return suggestions
+            keys = {geocode_cache_key(s["adresse_label"]): s["adresse_label"] for s in suggestions[:self.candidates]}
+            for key in set(self._futures) - set(keys):
+                self._futures.pop(key).cancel()
+            for key, label in keys.items():
+                if key not in self._futures:
+                    self._futures[key] = _executor.submit(self._enrich, label)
+            self._suggestions = suggestions
+        return list(suggestions)
+
+    def _enrich(self, adresse):
+        time.sleep(PREFETCH_DELAY)
+        with self._lock:
+            if geocode_cache_key(adresse) not in self._futures:
+                return None
+        # débit propre et plus bas que celui des adresses validées (http_client.speculative)
+        with metrics.stage("anticipation"), speculative():
+            return enrich_address(adresse, self.token)
+
+    def cancel(self):
+        """
+        Abandonne les enrichissements anticipés de la session (une fois l'adresse validée) ;
+        la saisie courante n'est pas réenrichie tant qu'elle ne change pas.
+        """
+        with self._lock:
+            self._generation += 1
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    def result(self, adresse, timeout=OVERALL_DEADLINE):
+        """
+        Résultat de enrich_address pour `adresse` si elle a été enrichie par avance
+        (attendu au plus `timeout` secondes s'il est en cours), sinon None.
+        Un résultat avec une source en erreur n'est pas réutilisé.
+        """
+        with self._lock:
+            future = self._futures.get(geocode_cache_key(adresse))
+        if future is None or future.cancelled():
+            log_event("anticipation", adresse=adresse, succes=False)
+            return None
+        try:
+            result = future.result(timeout=timeout)
+        except Exception:
+            result = None
+        if result is not None and result["errors"]:
+            result = None
+        log_event("anticipation", adresse=adresse, succes=result is not None)
+        return result
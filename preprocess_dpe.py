@@ -0,0 +1,24 @@
+"""
+Construction de l'index DPE local à partir de l'export en masse de l'ADEME (dpe03existant).
+
+    python preprocess_dpe.py dpe03existant.csv dpe_ok.parquet --departements 29 56
+"""
+import argparse
+
+from utils import traitement_dpe_streaming
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construction de l'index DPE local (export ADEME dpe03existant).")
+    parser.add_argument("input", help="CSV de l'export DPE de l'ADEME (éventuellement compressé)")
+    parser.add_argument("output", help="index DPE, .parquet ou .csv")
+    parser.add_argument("--departements", nargs="*", help="départements à garder (tous par défaut)")
+    parser.add_argument("--chunksize", type=int, default=500_000, help="nombre de lignes lues par bloc")
+    args = parser.parse_args()
+
+    rows = traitement_dpe_streaming(args.input, args.output, departements=args.departements, chunksize=args.chunksize)
+    print(f"{rows} DPE écrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Nettoyage du fichier DVF brut en ligne de commande.
+
+    python preprocess_dvf.py dvf.csv dvf_ok.parquet --chunksize 500000 --workers 8
+
+Mise à jour semestrielle : seules les nouvelles mutations sont nettoyées et ajoutées.
+
+    python preprocess_dvf.py dvf_2025_s1.csv dvf_ok.parquet --append --since 2024-07-01
+"""
+import argparse
+import os
+
+from dvf_aggregates import adresses_path, prix_m2_path
+from dvf_mmap import write_dvf_mmap
+from fuzzy_index import fuzzy_index_path
+from key_index import key_index_path
+from spatial_index import grid_path
+from surface_index import surface_index_path
+from store import DVFStore
+from utils import traitement_dvf_incremental, traitement_dvf_streaming
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nettoyage du fichier DVF brut (traitement_dvf par blocs).")
+    parser.add_argument("input", help="CSV DVF brut (export Etalab, éventuellement compressé)")
+    parser.add_argument("output", help="fichier nettoyé, .parquet ou .csv")
+    parser.add_argument("--chunksize", type=int, default=500_000, help="nombre de lignes lues par bloc")
+    parser.add_argument("--workers", type=int, default=1, help="nombre de processus (0 : tous les cœurs)")
+    parser.add_argument("--append", action="store_true",
+                        help="compléter le fichier nettoyé existant au lieu de le reconstruire")
+    parser.add_argument("--since", help="avec --append : ne traiter que les mutations à partir de cette date (AAAA-MM-JJ)")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count()
+    if args.append:
+        rows = traitement_dvf_incremental(args.input, args.output, since=args.since,
+                                          chunksize=args.chunksize, workers=workers)
+        print(f"{rows} lignes ajoutées à {args.output} (index étendus)")
+        if rows and args.output.endswith(".parquet"):
+            # les médianes ne s'étendent pas : tables agrégées recalculées sur toute la table
+            dvf_store = DVFStore(args.output)
+            write_mmap(dvf_store, write_aggregates(dvf_store))
+        return
+
+    rows = traitement_dvf_streaming(args.input, args.output, chunksize=args.chunksize, workers=workers)
+    print(f"{rows} lignes écrites dans {args.output}")
+
+    if args.output.endswith(".parquet"):
+        # index rangés à côté du fichier, relus par l'app au démarrage ; construits depuis la table
+        # (get_dvf_store servirait l'ancienne version des colonnes mappées jusqu'à write_mmap)
+        dvf_store = DVFStore(args.output)
+        dvf_store.spatial_grid()
+        print(f"index spatial écrit dans {grid_path(args.output)}")
+        dvf_store.parcel_index()
+        print(f"index des parcelles écrit dans {key_index_path(args.output, 'id_parcelle')}")
+        dvf_store.fuzzy_index()
+        print(f"index des adresses écrit dans {fuzzy_index_path(args.output)}")
+        dvf_store.surface_index()
+        print(f"index des surfaces écrit dans {surface_index_path(args.output)}")
+        write_mmap(dvf_store, write_aggregates(dvf_store))
+
+
+def write_aggregates(dvf_store):
+    aggregates = dvf_store.aggregates()
+    print(f"résumés par adresse écrits dans {adresses_path(dvf_store.path)}")
+    print(f"prix médians au m² écrits dans {prix_m2_path(dvf_store.path)}")
+    return aggregates
+
+
+def write_mmap(dvf_store, aggregates):
+    # en dernier : la nouvelle version remplace l'ancienne d'un bloc dans get_dvf_store ;
+    # les tables agrégées déjà calculées sont recopiées dans les colonnes mappées
+    print(f"colonnes mappées écrites dans {write_dvf_mmap(dvf_store.path, dvf_store.df, aggregates)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+
+from key_index import merge_postings
+
+
+def lonlat_to_lambert93(lon, lat):
+    """
+    Projection WGS84 -> Lambert-93 (EPSG:2154), vectorisée (tableaux numpy ou scalaires).
+    """
+    a, f = 6378137.0, 1 / 298.257222101
+    e = np.sqrt(2 * f - f * f)
+    lat_1, lat_2, lat_0, lon_0 = np.radians([49.0, 44.0, 46.5, 3.0])
+
+    def m(phi):
+        return np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+
+    def t(phi):
+        return np.tan(np.pi / 4 - phi / 2) / ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2)
+
+    n = (np.log(m(lat_1)) - np.log(m(lat_2))) / (np.log(t(lat_1)) - np.log(t(lat_2)))
+    F = m(lat_1) / (n * t(lat_1) ** n)
+    rho_0 = a * F * t(lat_0) ** n
+    rho = a * F * t(np.radians(lat)) ** n
+    theta = n * (np.radians(lon) - lon_0)
+    return 700000 + rho * np.sin(theta), 6600000 + rho_0 - rho * np.cos(theta)
+
+
+class SpatialGrid:
+    """
+    Index spatial en grille sur des points longitude/latitude.
+    Les points sont projetés en Lambert-93 et rangés par maille de `cell_size` mètres ;
+    une requête ne lit que les mailles qui touchent le cercle cherché.
+    """
+
+    def __init__(self, cell_size, cells, starts, order, x, y, rows):
+        self.cell_size = cell_size
+        self.rows = rows        # nombre de lignes de la table indexée
+        self.cells = cells      # identifiants des mailles non vides, triés
+        self.starts = starts    # début de chaque maille dans `order` (+ fin du dernier)
+        self.order = order      # positions des points dans la table, rangées par maille
+        self.x = x              # coordonnées des points, dans l'ordre de `order`
+        self.y = y
+
+    @staticmethod
+    def _cell_id(cx, cy):
+        return cx.astype(np.int64) * 1_000_000 + cy.astype(np.int64)
+
+    @classmethod
+    def build(cls, lon, lat, cell_size=50.0):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        valid = np.flatnonzero(~(np.isnan(lon) | np.isnan(lat)))
+        x, y = lonlat_to_lambert93(lon[valid], lat[valid])
+        ids = cls._cell_id(np.floor(x / cell_size), np.floor(y / cell_size))
+        sort = np.argsort(ids, kind="stable")
+        cells, starts = np.unique(ids[sort], return_index=True)
+        starts = np.append(starts, len(sort))
+        return cls(cell_size, cells, starts, valid[sort], x[sort], y[sort], len(lon))
+
+    def extend(self, lon, lat):
+        """
+        Index étendu aux points (lon, lat) ajoutés à la fin de la table, sans réindexer l'existant.
+        """
+        new = SpatialGrid.build(lon, lat, self.cell_size)
+        cells, starts, insert_at = merge_postings(self.cells, self.starts, new.cells, new.starts)
+        return SpatialGrid(
+            self.cell_size, cells, starts,
+            np.insert(self.order, insert_at, new.order + self.rows),
+            np.insert(self.x, insert_at, new.x), np.insert(self.y, insert_at, new.y),
+            self.rows + new.rows
+        )
+
+    def save(self, path):
+        np.savez(path, cell_size=self.cell_size, cells=self.cells, starts=self.starts,
+                 order=self.order, x=self.x, y=self.y, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(float(data["cell_size"]), data["cells"], data["starts"], data["order"],
+                   data["x"], data["y"], int(data["rows"]))
+
+    def __len__(self):
+        return len(self.order)
+
+    def _candidates(self, x, y, radius):
+        cx = np.arange(np.floor((x - radius) / self.cell_size), np.floor((x + radius) / self.cell_size) + 1)
+        cy = np.arange(np.floor((y - radius) / self.cell_size), np.floor((y + radius) / self.cell_size) + 1)
+        ids = self._cell_id(*np.meshgrid(cx, cy)).ravel()
+        slots = np.searchsorted(self.cells, ids)
+        slots = slots[(slots < len(self.cells)) & (self.cells[np.minimum(slots, len(self.cells) - 1)] == ids)]
+        if len(slots) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.starts[s], self.starts[s + 1]) for s in slots])
+
+    def within(self, lon, lat, radius):
+        """
+        Points à moins de `radius` mètres de (lon, lat) :
+        (positions dans la table, distances en mètres), du plus proche au plus loin.
+        """
+        x, y = lonlat_to_lambert93(lon, lat)
+        candidates = self._candidates(x, y, radius)
+        distances = np.hypot(self.x[candidates] - x, self.y[candidates] - y)
+        keep = distances <= radius
+        candidates, distances = candidates[keep], distances[keep]
+        sort = np.argsort(distances, kind="stable")
+        return self.order[candidates[sort]], distances[sort]
+
+    def nearest(self, lon, lat, k=10, max_radius=5_000):
+        """
+        Les `k` points les plus proches de (lon, lat), dans un rayon de `max_radius` mètres.
+        """
+        radius = self.cell_size
+        while True:
+            positions, distances = self.within(lon, lat, radius)
+            # tous les points du cercle sont connus : les k premiers sont les plus proches
+            if len(positions) >= k or radius >= max_radius:
+                return positions[:k], distances[:k]
+            radius = min(radius * 2, max_radius)
+
+
+def grid_path(table_path):
+    """
+    Fichier de l'index spatial rangé à côté de la table.
+    """
+    return f"{table_path}.grid.npz"
+
+
+def load_or_build_grid(table_path, lon, lat, cell_size=50.0):
+    """
+    Charge l'index spatial de la table s'il est à jour, sinon le reconstruit
+    et essaie de l'enregistrer à côté de la table.
+    """
+    path = grid_path(table_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(table_path):
+        grid = SpatialGrid.load(path)
+        if grid.rows == len(lon):
+            return grid
+    grid = SpatialGrid.build(lon, lat, cell_size)
+    try:
+        grid.save(path)
+    except OSError:
+        pass
+    return grid
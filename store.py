@@ -0,0 +1,411 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from dvf_aggregates import TOUS_TYPES, load_or_build_aggregates
+from dvf_mmap import DVFColumns, INDEXED_COLUMNS, dvf_mmap_path, table_signature
+from fuzzy_index import FuzzyAddressIndex, fuzzy_index_path, load_or_build_fuzzy_index
+from key_index import KeyIndex, key_index_path, load_or_build_key_index
+from metrics import log_event
+from spatial_index import SpatialGrid, grid_path, load_or_build_grid
+from surface_index import SurfaceIndex, load_or_build_surface_index, surface_index_path
+
+
+DVF_PATH = os.getenv("DVF_PATH", "dvf_ok.parquet")
+DPE_PATH = os.getenv("DPE_PATH", "dpe_ok.parquet")
+
+# Colonnes DVF chargées par l'app (le fichier Parquet en contient davantage)
+DVF_COLUMNS = [
+    'id_mutation', 'date_mutation', 'nature_mutation', 'valeur_fonciere',
+    'adresse_numero', 'adresse_suffixe', 'adresse_nom_voie', 'code_postal',
+    'code_commune', 'nom_commune', 'id_parcelle', 'code_type_local', 'type_local',
+    'surface_reelle_bati', 'nombre_pieces_principales', 'surface_terrain',
+    'longitude', 'latitude', 'adresse_complete'
+]
+
+
+def read_table(path, columns=None):
+    """
+    Lit une table de référence depuis le disque.
+    Les fichiers Parquet sont lus en mémoire mappée, seulement sur `columns`.
+    """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    return pd.read_csv(path, usecols=columns)
+
+
+class IndexedStore:
+    """
+    Table de référence chargée une seule fois par process et indexée par colonne
+    (index de hachage valeur -> positions des lignes).
+    La table est rechargée automatiquement quand le fichier change sur le disque.
+    """
+
+    def __init__(self, path, index_columns, columns=None):
+        self.path = path
+        self.index_columns = list(index_columns)
+        self.columns = columns
+        self._lock = threading.Lock()
+        # (signature du fichier, DataFrame, index) : remplacé d'un bloc au rechargement
+        self._state = (None, None, {})
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        df = read_table(self.path, self.columns)
+        indexes = {
+            col: df.groupby(col, sort=False, observed=True).indices
+            for col in self.index_columns
+            if col in df.columns
+        }
+        return df, indexes
+
+    def refresh(self):
+        """
+        Recharge la table si le fichier a été modifié depuis le dernier chargement.
+        """
+        signature = self._file_signature()
+        if signature != self._state[0]:
+            with self._lock:
+                if signature != self._state[0]:
+                    df, indexes = self._load()
+                    self._state = (signature, df, indexes)
+        return self._state
+
+    @property
+    def df(self):
+        return self.refresh()[1]
+
+    def positions(self, column, key):
+        """
+        Positions des lignes dont `column` vaut `key` (recherche O(1) dans l'index).
+        """
+        _, _, indexes = self.refresh()
+        return indexes[column].get(key, np.empty(0, dtype=np.intp))
+
+    def take(self, positions):
+        """
+        Lignes de la table aux `positions`.
+        """
+        return self.df.iloc[positions]
+
+    def lookup(self, column, key):
+        """
+        Renvoie les lignes dont `column` vaut `key`.
+        """
+        return self.take(self.positions(column, key))
+
+
+class DVFStore(IndexedStore):
+    """
+    Table DVF nettoyée (sortie de traitement_dvf), indexée par adresse, par parcelle
+    (index enregistré à côté du fichier), dans l'espace (grille sur longitude/latitude)
+    par trigrammes d'adresse et par (code postal, type de local, surface), avec ses tables
+    agrégées (résumé par adresse, prix au m²).
+    """
+
+    def __init__(self, path):
+        super().__init__(path, ["adresse_complete"], DVF_COLUMNS)
+        # index annexes : {nom: (signature du fichier, index)}
+        self._sidecars = {}
+
+    def lookup_adresse(self, adresse_complete):
+        return self.lookup("adresse_complete", adresse_complete)
+
+    def lookup_parcelle(self, id_parcelle):
+        return self.take(self.parcel_index().get(id_parcelle))
+
+    def _sidecar(self, name, build):
+        """
+        Index annexe de la table chargée, construit par `build(df)` une fois par version du fichier.
+        """
+        signature, df, _ = self.refresh()
+        cached = self._sidecars.get(name, (None, None))
+        if cached[0] != signature:
+            with self._lock:
+                cached = self._sidecars.get(name, (None, None))
+                if cached[0] != signature:
+                    cached = (signature, build(df))
+                    self._sidecars[name] = cached
+        return cached[1]
+
+    def spatial_grid(self):
+        """
+        Index spatial de la table chargée, lu à côté du fichier ou construit au premier appel.
+        """
+        return self._sidecar("grid", lambda df: load_or_build_grid(
+            self.path,
+            df["longitude"].to_numpy(dtype=float, na_value=np.nan),
+            df["latitude"].to_numpy(dtype=float, na_value=np.nan)
+        ))
+
+    def parcel_index(self):
+        """
+        Index id_parcelle -> lignes de la table chargée, lu à côté du fichier ou construit au premier appel.
+        """
+        return self._sidecar("parcelles", lambda df: load_or_build_key_index(
+            self.path, "id_parcelle", df["id_parcelle"]
+        ))
+
+    def fuzzy_index(self):
+        """
+        Index approché des adresses de la table, lu à côté du fichier ou construit au premier appel.
+        """
+        return self._sidecar("fuzzy", lambda df: load_or_build_fuzzy_index(
+            self.path, df["adresse_complete"].dropna().astype(str).unique()
+        ))
+
+    def surface_index(self):
+        """
+        Index (code postal, type de local, surface) de la table chargée, lu à côté du fichier
+        ou construit au premier appel.
+        """
+        return self._sidecar("surfaces", lambda df: load_or_build_surface_index(
+            self.path, df["code_postal"], df["code_type_local"], df["surface_reelle_bati"]
+        ))
+
+    def lookup_surface(self, surface, tolerance=0.05, code_postal=None, departement=None, type_local=None):
+        """
+        Mutations dont la surface bâtie est à +/- `tolerance` de `surface`, dans un code postal
+        (ou une liste), un département ou toute la table, pour un type de local ou les deux.
+        """
+        positions = self.surface_index().around(surface, tolerance, code_postal, departement, type_local)
+        return self.take(np.sort(positions))
+
+    def aggregates(self):
+        """
+        Tables agrégées de la table chargée, lues à côté du fichier ou construites au premier appel.
+        """
+        return self._sidecar("agregats", lambda df: load_or_build_aggregates(self.path, df))
+
+    def resume_adresse(self, adresse_complete):
+        """
+        Dernière mutation, nombre de mutations et surfaces connues de l'adresse (None si inconnue).
+        """
+        return self.aggregates().adresse(adresse_complete)
+
+    def prix_m2(self, code_commune, adresse_nom_voie=None, type_local=TOUS_TYPES):
+        """
+        Prix médians au m² par période glissante, pour la commune ou, avec `adresse_nom_voie`, pour la voie.
+        """
+        if adresse_nom_voie is None:
+            return self.aggregates().prix_m2("commune", code_commune, type_local)
+        return self.aggregates().prix_m2("voie", f"{code_commune}|{adresse_nom_voie}", type_local)
+
+    def search_adresse(self, adresse, k=5, code_postal=None):
+        """
+        Les `k` adresses DVF les plus proches de `adresse` (normalisée) : liste de (adresse, score).
+        """
+        return self.fuzzy_index().search(adresse, k, code_postal)
+
+    def lookup_adresse_fuzzy(self, adresse, code_postal=None, min_score=0.8):
+        """
+        Mutations de l'adresse DVF la plus proche de `adresse` (colonne score_adresse),
+        ou table vide si aucune n'atteint `min_score`.
+        """
+        candidates = self.search_adresse(adresse, 1, code_postal)
+        if not candidates or candidates[0][1] < min_score:
+            return self.take(np.empty(0, dtype=np.intp))
+        df = self.lookup_adresse(candidates[0][0]).copy()
+        df["score_adresse"] = round(candidates[0][1], 3)
+        return df
+
+    def _with_distance(self, positions, distances):
+        df = self.take(positions).copy()
+        df["distance_m"] = distances.round(1)
+        return df
+
+    def lookup_around(self, lon, lat, radius=30):
+        """
+        Mutations situées à moins de `radius` mètres du point, de la plus proche à la plus lointaine.
+        """
+        return self._with_distance(*self.spatial_grid().within(lon, lat, radius))
+
+    def lookup_nearest(self, lon, lat, k=10):
+        """
+        Les `k` mutations les plus proches du point.
+        """
+        return self._with_distance(*self.spatial_grid().nearest(lon, lat, k))
+
+
+class MappedDVFStore(DVFStore):
+    """
+    Table DVF lue dans sa version en colonnes mappées (dvf_mmap.write_dvf_mmap) :
+    colonnes et index restent sur le disque, partagés par tous les workers via le cache
+    du système, et seules les lignes renvoyées par les recherches sont décodées.
+    Mêmes méthodes de recherche que DVFStore, tables agrégées comprises.
+    La dernière version complète reste servie pendant la réécriture de la table.
+    """
+
+    def _file_signature(self):
+        # chaque version est un nouveau dossier, jamais modifié : son chemin suffit
+        path = dvf_mmap_path(self.path)
+        if path is None:
+            raise FileNotFoundError(f"colonnes mappées de {self.path} introuvables")
+        return path
+
+    def _load(self):
+        columns = DVFColumns(self._file_signature())
+        if os.path.exists(self.path) and columns.table != table_signature(self.path):
+            log_event("colonnes_mappees_perimees", table=self.path, version=columns.path)
+        return columns, {col: columns.key_index(col) for col in INDEXED_COLUMNS}
+
+    @property
+    def df(self):
+        """
+        Toute la table décodée en DataFrame (copie complète : préférer les méthodes de recherche).
+        """
+        columns = self.refresh()[1]
+        return columns.take(np.arange(len(columns)))
+
+    def take(self, positions):
+        return self.refresh()[1].take(positions)
+
+    def positions(self, column, key):
+        _, _, indexes = self.refresh()
+        return indexes[column].get(key)
+
+    def parcel_index(self):
+        return self.refresh()[2]["id_parcelle"]
+
+    def spatial_grid(self):
+        return self._sidecar("grid", lambda columns: columns.spatial_grid())
+
+    def fuzzy_index(self):
+        return self._sidecar("fuzzy", lambda columns: columns.fuzzy_index())
+
+    def surface_index(self):
+        return self._sidecar("surfaces", lambda columns: columns.surface_index())
+
+    def aggregates(self):
+        """
+        Tables agrégées lues dans les colonnes mappées ; pour un dossier écrit sans elles,
+        lues à côté de la table ou reconstruites depuis la table.
+        """
+        def load(columns):
+            aggregates = columns.aggregates()
+            if aggregates is None:
+                aggregates = load_or_build_aggregates(self.path, read_table(self.path, self.columns))
+            return aggregates
+        return self._sidecar("agregats", load)
+
+
+class DPEStore(IndexedStore):
+    """
+    Index DPE local (sortie de traitement_dpe_streaming), indexé par maille BAN
+    d'un mètre et par adresse BAN normalisée.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, ["cellule_ban", "adresse_ban_normalisee"])
+
+    def coordinates_positions(self, x, y, tolerance=0.5):
+        """
+        Positions des DPE situés à moins de `tolerance` mètres du point BAN (x, y), par date
+        de dernière modification : les 9 mailles autour du point sont lues, pour absorber
+        les arrondis des coordonnées.
+        """
+        cell = int(round(x)) * 10_000_000 + int(round(y))
+        positions = np.concatenate([
+            self.positions("cellule_ban", cell + dx * 10_000_000 + dy)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+        ])
+        df = self.df
+        positions = np.sort(positions)
+        distance = np.hypot(
+            df["coordonnee_cartographique_x_ban"].to_numpy()[positions] - x,
+            df["coordonnee_cartographique_y_ban"].to_numpy()[positions] - y
+        )
+        return self._by_modification_date(positions[distance <= tolerance])
+
+    def _by_modification_date(self, positions):
+        # du DPE le moins récemment modifié au plus récent, comme l'API (dates ISO : ordre du texte)
+        dates = self.df["date_derniere_modification_dpe"].to_numpy(dtype=object)[positions].astype(str)
+        return positions[np.argsort(dates, kind="stable")]
+
+    def lookup_coordinates(self, x, y, tolerance=0.5):
+        return self.df.iloc[self.coordinates_positions(x, y, tolerance)]
+
+    def adresse_positions(self, adresse_ban_normalisee):
+        """
+        Positions des DPE de l'adresse BAN normalisée, par date de dernière modification.
+        """
+        return self._by_modification_date(np.sort(self.positions("adresse_ban_normalisee", adresse_ban_normalisee)))
+
+    def lookup_adresse(self, adresse_ban_normalisee):
+        return self.df.iloc[self.adresse_positions(adresse_ban_normalisee)]
+
+
+def extend_dvf_indexes(path, old_rows, old_addresses, new):
+    """
+    Étend les index rangés à côté de la table DVF `path` aux lignes `new` ajoutées
+    à la fin d'une table qui en comptait `old_rows` (adresses distinctes `old_addresses`).
+    Un index absent ou périmé est laissé tel quel : il sera reconstruit au prochain chargement.
+    """
+    path_grid = grid_path(path)
+    if os.path.exists(path_grid):
+        grid = SpatialGrid.load(path_grid)
+        if grid.rows == old_rows:
+            grid.extend(new["longitude"].to_numpy(dtype=float, na_value=np.nan),
+                        new["latitude"].to_numpy(dtype=float, na_value=np.nan)).save(path_grid)
+
+    path_parcelles = key_index_path(path, "id_parcelle")
+    if os.path.exists(path_parcelles):
+        parcelles = KeyIndex.load(path_parcelles)
+        if parcelles.rows == old_rows:
+            parcelles.extend(new["id_parcelle"]).save(path_parcelles)
+
+    path_surfaces = surface_index_path(path)
+    if os.path.exists(path_surfaces):
+        surfaces = SurfaceIndex.load(path_surfaces)
+        if surfaces.rows == old_rows:
+            surfaces.extend(new["code_postal"], new["code_type_local"], new["surface_reelle_bati"]).save(path_surfaces)
+
+    path_fuzzy = fuzzy_index_path(path)
+    if os.path.exists(path_fuzzy):
+        fuzzy = FuzzyAddressIndex.load(path_fuzzy, old_addresses)
+        if len(fuzzy) == len(old_addresses):
+            # même ordre que DVFStore.fuzzy_index : adresses dans l'ordre de première apparition
+            addresses = new["adresse_complete"].dropna().astype(str).unique()
+            fuzzy.extend(addresses[~np.isin(addresses, old_addresses)]).save(path_fuzzy)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _get_store(cls, path):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if (cls, path) not in _stores:
+            _stores[(cls, path)] = cls(path)
+        return _stores[(cls, path)]
+
+
+def get_dvf_store(path=None):
+    """
+    Renvoie le store DVF partagé par tout le process (créé au premier appel) :
+    sur les colonnes mappées dès qu'une version existe, même si la table a été réécrite depuis
+    (elle est servie jusqu'à la suivante), sinon sur la table chargée en mémoire.
+    """
+    path = os.path.abspath(path or DVF_PATH)
+    if dvf_mmap_path(path) is None:
+        return _get_store(DVFStore, path)
+    with _stores_lock:
+        # table chargée avant l'écriture des colonnes mappées : libérée
+        _stores.pop((DVFStore, path), None)
+    return _get_store(MappedDVFStore, path)
+
+
+def get_dpe_store(path=None):
+    """
+    Renvoie l'index DPE local partagé par tout le process,
+    ou None s'il n'a pas été construit.
+    """
+    path = path or DPE_PATH
+    if not os.path.exists(path):
+        return None
+    return _get_store(DPEStore, path)
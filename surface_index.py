@@ -0,0 +1,144 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Codes DVF des types de local gardés par traitement_dvf
+TYPES_LOCAL = {"Maison": 1, "Appartement": 2}
+
+# Clé de tri : (code postal, type de local, surface) en un entier, surface < 1 000 000 m²
+_SURFACE_MAX = 1_000_000
+
+# Début des codes postaux de la Corse, dont les numéros de département ne sont pas des chiffres
+_PREFIXES_CORSE = {"2A": ("200", "201"), "2B": ("202", "206")}
+
+
+def _as_float(values):
+    return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def departement_prefixes(departement):
+    """
+    Débuts des codes postaux (sur 5 chiffres) d'un département : "29", "01", "974", "2A"...
+    """
+    departement = str(departement).upper().zfill(2)
+    return _PREFIXES_CORSE.get(departement, (departement,))
+
+
+def _key(code_postal, code_type_local, surface):
+    return (np.asarray(code_postal, dtype=np.int64) * 10 + code_type_local) * _SURFACE_MAX + surface
+
+
+class SurfaceIndex:
+    """
+    Index trié des lignes de la table par (code postal, type de local, surface bâtie),
+    rangées en une seule clé entière. Une recherche par plage de surface est une
+    recherche dichotomique par (code postal, type) suivie d'une tranche.
+    """
+
+    def __init__(self, keys, order, rows):
+        self.keys = keys    # clés triées
+        self.order = order  # positions des lignes dans la table, dans l'ordre des clés
+        self.rows = rows    # nombre de lignes de la table indexée
+        self._codes_postaux = None
+
+    @classmethod
+    def build(cls, code_postal, code_type_local, surface):
+        code_postal, code_type_local, surface = (
+            _as_float(code_postal), _as_float(code_type_local), _as_float(surface)
+        )
+        # lignes sans code postal, type ou surface : non indexées
+        valid = np.flatnonzero(~(np.isnan(code_postal) | np.isnan(code_type_local) | np.isnan(surface))
+                               & (surface >= 0) & (surface < _SURFACE_MAX))
+        keys = _key(code_postal[valid], code_type_local[valid].astype(np.int64), surface[valid].astype(np.int64))
+        sort = np.argsort(keys, kind="stable")
+        return cls(keys[sort], valid[sort], len(surface))
+
+    def extend(self, code_postal, code_type_local, surface):
+        """
+        Index étendu aux lignes ajoutées à la fin de la table, sans retrier l'existant.
+        """
+        new = SurfaceIndex.build(code_postal, code_type_local, surface)
+        # à clé égale, les nouvelles lignes viennent après les anciennes (tri stable)
+        insert_at = np.searchsorted(self.keys, new.keys, side="right")
+        return SurfaceIndex(np.insert(self.keys, insert_at, new.keys),
+                            np.insert(self.order, insert_at, new.order + self.rows), self.rows + new.rows)
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, order=self.order, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["keys"], data["order"], int(data["rows"]))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def codes_postaux(self):
+        """
+        Codes postaux présents, triés (calculés au premier appel).
+        """
+        if self._codes_postaux is None:
+            # clés triées : les codes postaux aussi, un changement de valeur suffit
+            codes = self.keys // (10 * _SURFACE_MAX)
+            self._codes_postaux = codes[np.flatnonzero(np.diff(codes, prepend=-1))]
+        return self._codes_postaux
+
+    def range(self, surface_min, surface_max, codes_postaux, types=(1, 2)):
+        """
+        Positions des lignes dont la surface est dans [surface_min, surface_max],
+        pour les codes postaux et les codes de type de local donnés.
+        """
+        low, high = math.ceil(surface_min), math.floor(surface_max)
+        if high < low:
+            return np.empty(0, dtype=np.intp)
+        blocks = (np.asarray(codes_postaux, dtype=np.int64)[:, None] * 10 + np.asarray(types)[None, :]).ravel()
+        starts = np.searchsorted(self.keys, blocks * _SURFACE_MAX + max(low, 0), side="left")
+        ends = np.searchsorted(self.keys, blocks * _SURFACE_MAX + min(high, _SURFACE_MAX - 1), side="right")
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends)] or [[]]).astype(np.intp)
+
+    def around(self, surface, tolerance=0.05, codes_postaux=None, departement=None, type_local=None):
+        """
+        Positions des lignes à +/- `tolerance` de `surface`, dans les codes postaux donnés
+        ou dans tout le département (début du code postal : "29", "974", "2A"...),
+        pour un type de local ("Maison", "Appartement", code DVF) ou les deux.
+        """
+        if codes_postaux is None:
+            codes_postaux = self.codes_postaux()
+            if departement is not None:
+                prefixes = departement_prefixes(departement)
+                codes_postaux = codes_postaux[
+                    pd.Series(codes_postaux.astype(str)).str.zfill(5).str.startswith(prefixes).to_numpy()
+                ]
+        elif np.isscalar(codes_postaux):
+            codes_postaux = [int(codes_postaux)]
+        types = (1, 2) if type_local is None else (TYPES_LOCAL.get(type_local, type_local),)
+        return self.range(surface * (1 - tolerance), surface * (1 + tolerance), codes_postaux, types)
+
+
+def surface_index_path(table_path):
+    """
+    Fichier de l'index des surfaces rangé à côté de la table.
+    """
+    return f"{table_path}.surfaces.npz"
+
+
+def load_or_build_surface_index(table_path, code_postal, code_type_local, surface):
+    """
+    Charge l'index des surfaces s'il est à jour, sinon le reconstruit
+    et essaie de l'enregistrer à côté de la table.
+    """
+    path = surface_index_path(table_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(table_path):
+        index = SurfaceIndex.load(path)
+        if index.rows == len(surface):
+            return index
+    index = SurfaceIndex.build(code_postal, code_type_local, surface)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
@@ -1,8 +1,39 @@
 import requests
+import csv
 import json
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import CACHE_PATH, TieredCache
+from http_client import get_client
+from spatial_index import lonlat_to_lambert93
+from store import extend_dvf_indexes, get_dpe_store, read_table
+
+
+# Colonnes texte peu variées, encodées en dictionnaire dans le fichier DVF nettoyé.
+# code_postal n'en fait pas partie : entier nullable (Int64), il est déjà compact en Parquet
+# et garde son type nullable à la relecture (une catégorie d'entiers reviendrait en int64)
+DVF_CATEGORIES = ['nom_commune', 'type_local']
+
+# Clé de dédoublonnage des mutations
+DVF_DEDUP_KEY = ['adresse_complete', 'id_parcelle', 'type_local', 'date_mutation', 'longitude', 'latitude']
+
+# Champs de la fiche de bien remplis par chaque source
+DVF_FIELDS = ['surface_reelle_bati', 'nombre_pieces_principales', 'surface_terrain']
+DPE_FIELDS = ['numero_dpe','adresse_ban','etiquette_dpe','date_etablissement_dpe','date_derniere_modification_dpe','etiquette_ges','conso_5 usages_par_m2_ef','conso_5_usages_par_m2_ep','emission_ges_5_usages par_m2','annee_construction','type_batiment','nombre_niveau_logement','complement_adresse_logement','surface_habitable_logement','type_installation_chauffage']
+
+# Colonnes de l'export DPE de l'ADEME utilisées pour l'index local
+DPE_X, DPE_Y = 'coordonnee_cartographique_x_ban', 'coordonnee_cartographique_y_ban'
+DPE_DEPARTEMENT = 'code_departement_ban'
+# Champs numériques de l'export DPE (lu en texte) : décimaux, puis entiers
+DPE_FLOAT_FIELDS = ['conso_5 usages_par_m2_ef', 'conso_5_usages_par_m2_ep', 'emission_ges_5_usages par_m2', 'surface_habitable_logement']
+DPE_INT_FIELDS = ['annee_construction', 'nombre_niveau_logement']
 
 
 def convert_to_int(df):
@@ -14,54 +45,386 @@ def convert_to_int(df):
     df['surface_terrain'] = pd.to_numeric(df['surface_terrain'], errors='coerce').astype('Int64')
     return df
 
+def convert_to_float(df):
+    df['valeur_fonciere'] = pd.to_numeric(df['valeur_fonciere'], errors='coerce')
+    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
+    return df
+
+# Abréviations des libellés DVF/cadastre, remplacées par la forme utilisée dans les libellés BAN.
+# Les types de voie et les indices de répétition ne sont développés qu'à leur place,
+# juste après le numéro (et l'indice). PAS et LOT, trop ambigus (PAS DE LA MAIRIE), ne sont pas développés
+STREET_TYPE_ABBREVIATIONS = {
+    'ALL': 'ALLEE', 'AV': 'AVENUE', 'BD': 'BOULEVARD', 'BLD': 'BOULEVARD', 'CAR': 'CARREFOUR',
+    'CHE': 'CHEMIN', 'CHEM': 'CHEMIN', 'CHS': 'CHAUSSEE', 'CRS': 'COURS', 'DOM': 'DOMAINE',
+    'ESP': 'ESPLANADE', 'FG': 'FAUBOURG', 'HAM': 'HAMEAU', 'IMP': 'IMPASSE',
+    'MTE': 'MONTEE', 'PL': 'PLACE', 'PLN': 'PLAINE', 'PRO': 'PROMENADE',
+    'PROM': 'PROMENADE', 'PRV': 'PARVIS', 'PTE': 'PORTE', 'QU': 'QUAI', 'QUA': 'QUARTIER',
+    'RES': 'RESIDENCE', 'RLE': 'RUELLE', 'RPT': 'ROND POINT', 'RTE': 'ROUTE', 'SEN': 'SENTIER',
+    'SQ': 'SQUARE', 'TRA': 'TRAVERSE', 'VLA': 'VILLA', 'VOI': 'VOIE', 'ZA': 'ZONE ARTISANALE',
+    'ZI': 'ZONE INDUSTRIELLE'
+}
+ADDRESS_SUFFIXES = {'BIS': 'B', 'TER': 'T', 'QUATER': 'Q'}
+# Titres des noms de voie, développés partout
+NAME_ABBREVIATIONS = {
+    'ST': 'SAINT', 'STE': 'SAINTE', 'GAL': 'GENERAL', 'MAL': 'MARECHAL', 'PDT': 'PRESIDENT',
+    'DR': 'DOCTEUR', 'PR': 'PROFESSEUR', 'CDT': 'COMMANDANT', 'LT': 'LIEUTENANT'
+}
+_SUFFIX_PATTERN = r'^(\d+) (' + '|'.join(ADDRESS_SUFFIXES) + r')\b'
+_STREET_TYPE_PATTERN = r'^(\d+(?: [A-Z])?) (' + '|'.join(STREET_TYPE_ABBREVIATIONS) + r')\b'
+_NAME_PATTERN = r'\b(?:' + '|'.join(NAME_ABBREVIATIONS) + r')\b'
+
+def _expand_abbreviations(words):
+    # même règle que les expressions de normalize_address_series, mot par mot
+    if words and words[0].isdigit():
+        if len(words) > 1 and words[1] in ADDRESS_SUFFIXES:
+            words[1] = ADDRESS_SUFFIXES[words[1]]
+        if len(words) > 2 and len(words[1]) == 1 and words[1].isalpha() and words[2] in STREET_TYPE_ABBREVIATIONS:
+            words[2] = STREET_TYPE_ABBREVIATIONS[words[2]]
+        elif len(words) > 1 and words[1] in STREET_TYPE_ABBREVIATIONS:
+            words[1] = STREET_TYPE_ABBREVIATIONS[words[1]]
+    return " ".join(NAME_ABBREVIATIONS.get(word, word) for word in words)
+
 def normalize_address(adr):
     # Supprimer les accents
     nfkd_form = unicodedata.normalize('NFKD', adr)
     without_accents = "".join([c for c in nfkd_form if not unicodedata.combining(c)])
-    # Supprimer les caractères spéciaux
-    clean = re.sub(r'[^A-Za-z0-9\s]', '', without_accents)
-    # Mettre en majuscules
-    return clean.upper().strip()
+    # Remplacer les caractères spéciaux par des espaces (SAINT-JEAN -> SAINT JEAN)
+    clean = re.sub(r'[^A-Za-z0-9\s]', ' ', without_accents)
+    # Mettre en majuscules, développer les abréviations et supprimer les doubles espaces
+    return _expand_abbreviations(clean.upper().split())
+
+def normalize_address_series(s):
+    """
+    Version vectorisée de normalize_address, appliquée à une colonne entière.
+    """
+    return (
+        s.str.normalize('NFKD')
+        # accents décomposés par NFKD supprimés, puis caractères spéciaux remplacés par des espaces
+        .str.replace('[\u0300-\u036f]', '', regex=True)
+        .str.replace(r'[^A-Za-z0-9\s]', ' ', regex=True)
+        .str.upper()
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+        .str.replace(_SUFFIX_PATTERN, lambda m: f"{m.group(1)} {ADDRESS_SUFFIXES[m.group(2)]}", regex=True)
+        .str.replace(_STREET_TYPE_PATTERN, lambda m: f"{m.group(1)} {STREET_TYPE_ABBREVIATIONS[m.group(2)]}", regex=True)
+        .str.replace(_NAME_PATTERN, lambda m: NAME_ABBREVIATIONS[m.group(0)], regex=True)
+    )
 
 def create_adresse_complete(df):
     # Nettoyage des NaN
-    df[['adresse_suffixe', 'adresse_nom_voie', 'code_postal', 'nom_commune']] = \
-        df[['adresse_suffixe', 'adresse_nom_voie', 'code_postal', 'nom_commune']].fillna('')
-
-    # Création sans doubles espaces
-    df['adresse_complete'] = df.apply(
-        lambda row: " ".join(
-            str(x) for x in [
-                row['adresse_numero'],
-                row['adresse_suffixe'],
-                row['adresse_nom_voie'] + ",",
-                str(row['code_postal']),
-                row['nom_commune'].upper()
-            ] if str(x).strip()
-        ),
-        axis=1
+    df[['adresse_suffixe', 'adresse_nom_voie', 'nom_commune']] = \
+        df[['adresse_suffixe', 'adresse_nom_voie', 'nom_commune']].fillna('')
+
+    # Création colonne par colonne (les doubles espaces des champs vides disparaissent à la normalisation)
+    adresse = df['adresse_numero'].astype('string').fillna('').str.cat(
+        [
+            df['adresse_suffixe'].astype('string'),
+            df['adresse_nom_voie'].astype('string') + ",",
+            df['code_postal'].astype('string').fillna(''),
+            df['nom_commune'].astype('string').str.upper()
+        ],
+        sep=" "
     )
 
     # Normalisation finale
-    df["adresse_complete"] = df["adresse_complete"].apply(normalize_address)
-    
+    df["adresse_complete"] = normalize_address_series(adresse).astype(str)
+
     return df
 
+def header_rows_mask(df):
+    """
+    Repère les lignes d'en-tête répétées (fichiers concaténés) :
+    une valeur égale au nom de sa colonne.
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        # une colonne numérique ne peut pas contenir son propre nom
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            mask |= df[col].eq(col).to_numpy(dtype=bool, na_value=False)
+    return mask
+
 def traitement_dvf(df):
     #je supprime les lignes où les valeurs sont égales au nom de la colonne
-    mask = df.apply(lambda row: any(row[col] == col for col in df.columns), axis=1)
-    df = df[~mask]
+    df = df[~header_rows_mask(df)]
     #je ne garde que les appartements et les maisons
-    df = df.loc[(df['code_type_local'] == 1) | (df['code_type_local'] == 2)]
+    # (colonne lue comme texte quand le fichier contient des lignes d'en-tête répétées)
+    code_type_local = pd.to_numeric(df['code_type_local'], errors='coerce')
+    df = df.loc[(code_type_local == 1) | (code_type_local == 2)]
     df = convert_to_int(df)
+    df = convert_to_float(df)
     df = create_adresse_complete(df)
-    df.drop_duplicates(subset=['adresse_complete', 'id_parcelle', 'type_local', 'date_mutation', 'longitude', 'latitude'], inplace=True)
+    df.drop_duplicates(subset=DVF_DEDUP_KEY, inplace=True)
+    return df
+
+def _partition_dvf(df, n_partitions):
+    """
+    Découpe le DVF brut en `n_partitions` morceaux selon le code postal.
+    adresse_complete contient le code postal : deux doublons tombent toujours
+    dans le même morceau.
+    """
+    code_postal = pd.to_numeric(df['code_postal'], errors='coerce')
+    partition = pd.util.hash_pandas_object(code_postal, index=False).to_numpy() % n_partitions
+    return [df[partition == i] for i in range(n_partitions)]
+
+def traitement_dvf_parallel(df, workers=None, executor=None):
+    """
+    traitement_dvf exécuté en parallèle sur plusieurs processus, un morceau
+    de codes postaux par tâche. Le résultat est identique à traitement_dvf(df),
+    lignes dans le même ordre.
+    """
+    workers = workers or os.cpu_count()
+    if not df.index.is_unique:
+        df = df.reset_index(drop=True)
+    # plusieurs morceaux par processus pour équilibrer les grosses communes
+    shards = [shard for shard in _partition_dvf(df, workers * 4) if len(shard)]
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(traitement_dvf, shards))
+    else:
+        results = list(executor.map(traitement_dvf, shards))
+    if not results:
+        return traitement_dvf(df)
+    # fusion déterministe : on reprend l'ordre d'origine des lignes
+    return pd.concat(results).sort_index(kind='stable')
+
+class TableWriter:
+    """
+    Écrit une table nettoyée (DVF, DPE) bloc par bloc, en Parquet compressé ou en CSV
+    selon l'extension de `path`. En Parquet, les types (Int64...) sont conservés
+    et les colonnes de `categories` sont encodées en dictionnaire.
+    """
+
+    def __init__(self, path, categories=DVF_CATEGORIES, schema=None):
+        self.path = path
+        self.categories = list(categories)
+        self.rows = 0
+        self._parquet = path.endswith(".parquet")
+        self._writer = None
+        # schéma imposé (Parquet) : celui d'un fichier existant que l'on complète
+        self._schema = schema
+
+    def _arrow_schema(self, df):
+        # le schéma du premier bloc sert pour tout le fichier :
+        # colonnes vides -> texte, catégories -> dictionnaire à index 32 bits
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        fields = []
+        for field in schema:
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            elif pa.types.is_dictionary(field.type):
+                value_type = field.type.value_type
+                if pa.types.is_large_string(value_type):
+                    value_type = pa.string()
+                field = field.with_type(pa.dictionary(pa.int32(), value_type))
+            fields.append(field)
+        return pa.schema(fields, metadata=schema.metadata)
+
+    def write(self, df):
+        if self._parquet:
+            df = df.astype({col: 'category' for col in self.categories if col in df.columns})
+            if self._schema is None:
+                self._schema = self._arrow_schema(df)
+            self.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+            return
+        df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def write_table(self, table):
+        """
+        Écrit une table Arrow déjà au bon schéma (Parquet uniquement), sans passer par pandas.
+        """
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self._schema or table.schema, compression='zstd')
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_dvf(df, path):
+    """
+    Écrit la table DVF nettoyée au format Parquet compressé (ou CSV), voir TableWriter.
+    """
+    with TableWriter(path) as writer:
+        writer.write(df)
+
+def _drop_seen(df, seen):
+    """
+    Retire de `df` les lignes dont l'empreinte de DVF_DEDUP_KEY est déjà dans `seen`
+    (tableau trié d'empreintes 64 bits) et renvoie le tableau mis à jour.
+    """
+    hashes = pd.util.hash_pandas_object(df[DVF_DEDUP_KEY], index=False).to_numpy()
+    positions = np.searchsorted(seen, hashes)
+    already_seen = np.zeros(len(hashes), dtype=bool)
+    in_range = positions < len(seen)
+    already_seen[in_range] = seen[positions[in_range]] == hashes[in_range]
+    # les empreintes d'un bloc sont distinctes (traitement_dvf dédoublonne) :
+    # un tri suffit, np.union1d est bien plus lent sur des dizaines de millions d'empreintes
+    return df[~already_seen], np.sort(np.concatenate([seen, hashes[~already_seen]]))
+
+def traitement_dvf_streaming(input_path, output_path, chunksize=500_000, workers=1):
+    """
+    Version par blocs de traitement_dvf pour les fichiers plus gros que la RAM :
+    le CSV brut est lu par blocs de `chunksize` lignes, chaque bloc est nettoyé
+    puis écrit aussitôt dans `output_path`.
+    Le dédoublonnage entre blocs se fait sur une empreinte de DVF_DEDUP_KEY :
+    seuls 8 octets par mutation conservée restent en mémoire.
+    Avec `workers` > 1, chaque bloc est nettoyé par traitement_dvf_parallel.
+    Renvoie le nombre de lignes écrites.
+    """
+    seen = np.empty(0, dtype=np.uint64)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with TableWriter(output_path) as writer:
+            # tout est lu en texte : les types ne varient pas d'un bloc à l'autre
+            for chunk in pd.read_csv(input_path, sep=',', dtype=str, chunksize=chunksize):
+                if pool is None:
+                    chunk = traitement_dvf(chunk)
+                else:
+                    chunk = traitement_dvf_parallel(chunk, workers, executor=pool)
+                chunk, seen = _drop_seen(chunk, seen)
+                if len(chunk):
+                    writer.write(chunk)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return writer.rows
+
+def traitement_dvf_incremental(input_path, output_path, since=None, chunksize=500_000, workers=1):
+    """
+    Ajoute à la table DVF déjà nettoyée `output_path` les mutations d'un nouveau fichier brut
+    (semestre publié par Etalab) : mêmes nettoyages que traitement_dvf_streaming, lignes déjà
+    présentes écartées sur DVF_DEDUP_KEY, et avec `since` ('AAAA-MM-JJ') seules les mutations
+    à partir de cette date sont traitées.
+    Les lignes existantes ne sont pas retraitées : elles sont recopiées telles quelles
+    (Parquet) ou le fichier est complété (CSV), et les index rangés à côté de la table
+    sont étendus aux nouvelles lignes. Renvoie le nombre de lignes ajoutées.
+    """
+    existing = read_table(output_path, DVF_DEDUP_KEY)[DVF_DEDUP_KEY]
+    old_rows = len(existing)
+    seen = np.sort(pd.util.hash_pandas_object(existing, index=False).to_numpy())
+    old_addresses = existing['adresse_complete'].dropna().astype(str).unique()
+    del existing
+
+    parquet = output_path.endswith(".parquet")
+    root, ext = os.path.splitext(output_path)
+    target = f"{root}.tmp{ext}" if parquet else output_path
+    new_parts = []
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with TableWriter(target, schema=pq.read_schema(output_path) if parquet else None) as writer:
+            if parquet:
+                # recopie des blocs existants, sans conversion ni nettoyage
+                source = pq.ParquetFile(output_path)
+                for i in range(source.num_row_groups):
+                    writer.write_table(source.read_row_group(i))
+            else:
+                # le fichier CSV est complété : pas de nouvel en-tête
+                writer.rows = old_rows
+            for chunk in pd.read_csv(input_path, sep=',', dtype=str, chunksize=chunksize):
+                if since is not None:
+                    chunk = chunk[chunk['date_mutation'] >= since]
+                if pool is None:
+                    chunk = traitement_dvf(chunk)
+                else:
+                    chunk = traitement_dvf_parallel(chunk, workers, executor=pool)
+                chunk, seen = _drop_seen(chunk, seen)
+                if len(chunk):
+                    writer.write(chunk)
+                    new_parts.append(chunk[['adresse_complete', 'id_parcelle', 'longitude', 'latitude',
+                                            'code_postal', 'code_type_local', 'surface_reelle_bati']])
+    except BaseException:
+        if parquet and os.path.exists(target):
+            os.remove(target)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if not new_parts:
+        # rien de nouveau : la table et ses index restent intacts
+        if parquet:
+            os.remove(target)
+        return 0
+    if parquet:
+        os.replace(target, output_path)
+    extend_dvf_indexes(output_path, old_rows, old_addresses, pd.concat(new_parts, ignore_index=True))
+    return writer.rows - old_rows
+
+def dpe_cell(x, y):
+    """
+    Identifiant de la maille d'un mètre (Lambert-93) qui contient le point (x, y).
+    """
+    return np.round(x).astype('int64') * 10_000_000 + np.round(y).astype('int64')
+
+def traitement_dpe(df, departements=None):
+    """
+    Nettoie un morceau de l'export DPE de l'ADEME pour l'index local :
+    garde les départements demandés et les colonnes de DPE_FIELDS (champs numériques
+    convertis), ajoute la maille BAN et l'adresse BAN normalisée.
+    """
+    if departements:
+        df = df[df[DPE_DEPARTEMENT].astype(str).str.zfill(2).isin([str(d).zfill(2) for d in departements])]
+    df = df[DPE_FIELDS + [DPE_X, DPE_Y]].copy()
+    # types fixés (et non déduits de chaque bloc) : le schéma du premier bloc vaut pour tout le fichier
+    for col in DPE_FLOAT_FIELDS + [DPE_X, DPE_Y]:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col in DPE_INT_FIELDS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').round().astype('Int64')
+    df = df.dropna(subset=[DPE_X, DPE_Y])
+    df['cellule_ban'] = dpe_cell(df[DPE_X], df[DPE_Y])
+    df['adresse_ban_normalisee'] = normalize_address_series(df['adresse_ban'].fillna('').astype('string')).astype(str)
     return df
 
+def traitement_dpe_streaming(input_path, output_path, departements=None, chunksize=500_000):
+    """
+    Construit l'index DPE local à partir de l'export en masse de l'ADEME, lu et écrit
+    par blocs : un seul bloc en mémoire à la fois. Les lignes gardent l'ordre de l'export ;
+    DPEStore les renvoie triées par date de dernière modification, comme l'API.
+    Renvoie le nombre de lignes écrites.
+    """
+    usecols = DPE_FIELDS + [DPE_X, DPE_Y] + ([DPE_DEPARTEMENT] if departements else [])
+    with TableWriter(output_path, categories=['type_batiment', 'type_installation_chauffage']) as writer:
+        for chunk in pd.read_csv(input_path, usecols=usecols, dtype=str, chunksize=chunksize):
+            writer.write(traitement_dpe(chunk, departements))
+    return writer.rows
+
+# Cache du géocodage BAN : résultats trouvés et adresses introuvables (TTL en secondes)
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+GEOCODE_NEGATIVE_CACHE_TTL = float(os.getenv("GEOCODE_NEGATIVE_CACHE_TTL", 24 * 3600))
+geocode_cache = TieredCache("geocodage", ttl=GEOCODE_CACHE_TTL, maxsize=10_000, path=CACHE_PATH)
+geocode_negative_cache = TieredCache("geocodage_introuvable", ttl=GEOCODE_NEGATIVE_CACHE_TTL, maxsize=10_000, path=CACHE_PATH)
+# géocodage en masse sans x/y de la BAN (x/y recalculés) : gardé aussi peu que les adresses introuvables,
+# et séparé de geocode_cache, qui sert get_coordinates_from_address
+geocode_bulk_cache = TieredCache("geocodage_masse", ttl=GEOCODE_NEGATIVE_CACHE_TTL, maxsize=10_000, path=CACHE_PATH)
+
+def geocode_cache_key(address: str, limit: int = 1):
+    return f"{normalize_address(address)}|{limit}"
+
+def geocode_cache_stats():
+    return {"geocodage": geocode_cache.stats(), "geocodage_introuvable": geocode_negative_cache.stats(),
+            "geocodage_masse": geocode_bulk_cache.stats()}
+
 def get_coordinates_from_address(address: str, limit: int = 1):
     """
     Récupère les coordonnées GPS et infos à partir d'une adresse via l'API BAN.
+    Les réponses (y compris "Adresse introuvable") sont mises en cache.
     """
+    cache_key = geocode_cache_key(address, limit)
+    cached = geocode_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+    if geocode_negative_cache.get(cache_key) is not None:
+        return {"error": "Adresse introuvable"}
+
     base_url = "https://api-adresse.data.gouv.fr/search/"
     params = {
         "q": address,
@@ -69,34 +432,184 @@ def get_coordinates_from_address(address: str, limit: int = 1):
     }
 
     try:
-        response = requests.get(base_url, params=params, timeout=5)
+        response = get_client().get(base_url, params=params)
         response.raise_for_status()
         data = response.json()
 
         if not data.get("features"):
+            geocode_negative_cache.set(cache_key, True)
             return {"error": "Adresse introuvable"}
 
-        feature = data["features"][0]
-        longitude, latitude = feature["geometry"]["coordinates"]
-        properties = feature["properties"]
-
-        result = {
-            "adresse_label": properties.get("label"),
-            "latitude": latitude,
-            "longitude": longitude,
-            "code_insee": properties.get("citycode"),
-            "code_postal": properties.get("postcode"),
-            "coord_geo_x": properties.get("x"),
-            "coord_geo_y": properties.get("y")
-        }
-        return result
+        result = _parse_ban_feature(data["features"][0])
+        geocode_cache.set(cache_key, result)
+        return dict(result)
 
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
-    
+
+def _parse_ban_feature(feature):
+    longitude, latitude = feature["geometry"]["coordinates"]
+    properties = feature["properties"]
+    return {
+        "adresse_label": properties.get("label"),
+        "latitude": latitude,
+        "longitude": longitude,
+        "code_insee": properties.get("citycode"),
+        "code_postal": properties.get("postcode"),
+        "coord_geo_x": properties.get("x"),
+        "coord_geo_y": properties.get("y")
+    }
+
+# Autocomplétion BAN : longueur minimale de la saisie (imposée par l'API) et durée de vie en cache
+AUTOCOMPLETE_MIN_CHARS = 3
+AUTOCOMPLETE_CACHE_TTL = float(os.getenv("AUTOCOMPLETE_CACHE_TTL", 24 * 3600))
+# en mémoire seulement : les saisies partielles ne servent que le temps de la frappe
+autocomplete_cache = TieredCache("autocompletion", ttl=AUTOCOMPLETE_CACHE_TTL, maxsize=10_000)
+
+def get_address_suggestions(partial_address: str, limit: int = 5):
+    """
+    Adresses BAN complétant une saisie partielle (autocomplétion), au format de
+    get_coordinates_from_address. Chaque suggestion alimente le cache de géocodage
+    sous son libellé : la choisir ne coûte plus d'appel à la BAN.
+    Liste vide si la saisie est trop courte ou si l'appel échoue.
+    """
+    partial_address = partial_address.strip()
+    if len(partial_address) < AUTOCOMPLETE_MIN_CHARS:
+        return []
+    cache_key = f"{normalize_address(partial_address)}|{limit}"
+    cached = autocomplete_cache.get(cache_key)
+    if cached is not None:
+        return [dict(suggestion) for suggestion in cached]
+
+    base_url = "https://api-adresse.data.gouv.fr/search/"
+    params = {
+        "q": partial_address,
+        "limit": limit,
+        "autocomplete": 1
+    }
+
+    try:
+        response = get_client().get(base_url, params=params)
+        response.raise_for_status()
+        suggestions = [_parse_ban_feature(feature) for feature in response.json().get("features", [])]
+    except requests.exceptions.RequestException:
+        return []
+    for suggestion in suggestions:
+        geocode_cache.set(geocode_cache_key(suggestion["adresse_label"]), suggestion)
+    autocomplete_cache.set(cache_key, suggestions)
+    return [dict(suggestion) for suggestion in suggestions]
+
+def lambert93_from_lonlat(lon, lat):
+    """
+    Projection WGS84 -> Lambert-93 (EPSG:2154), arrondie au centimètre comme les x/y de la BAN.
+    """
+    x, y = lonlat_to_lambert93(lon, lat)
+    return round(float(x), 2), round(float(y), 2)
+
+# Nombre d'adresses envoyées par requête au géocodage en masse de la BAN
+BAN_CSV_CHUNK_SIZE = 5_000
+
+def _parse_ban_csv_row(row):
+    # csv.DictReader : une cellule vide est une chaîne vide
+    row = {key: value if value != "" else None for key, value in row.items()}
+    if pd.isna(row.get("result_label")) or pd.isna(row.get("longitude")):
+        return {"error": "Adresse introuvable"}
+    longitude, latitude = float(row["longitude"]), float(row["latitude"])
+    if pd.notna(row.get("result_x")) and pd.notna(row.get("result_y")):
+        x, y = float(row["result_x"]), float(row["result_y"])
+    else:
+        # x/y absents de la réponse CSV : recalculés depuis longitude/latitude
+        x, y = lambert93_from_lonlat(longitude, latitude)
+    return {
+        "adresse_label": row["result_label"],
+        "latitude": latitude,
+        "longitude": longitude,
+        "code_insee": row.get("result_citycode"),
+        "code_postal": row.get("result_postcode"),
+        "coord_geo_x": x,
+        "coord_geo_y": y
+    }
+
+def get_coordinates_bulk(addresses, chunk_size=BAN_CSV_CHUNK_SIZE):
+    """
+    Géocode une liste d'adresses par morceaux via l'endpoint CSV de l'API BAN
+    (une requête pour `chunk_size` adresses).
+    Génère les couples (adresse, résultat) morceau par morceau, résultat au même
+    format que get_coordinates_from_address. Le cache de géocodage n'est alimenté que par
+    les réponses qui portent les x/y de la BAN (l'endpoint CSV peut ne renvoyer que
+    longitude/latitude, arrondies au micro-degré : x/y sont alors recalculés, à ~7 cm près) ;
+    les autres sont gardées dans geocode_bulk_cache, avec la durée de vie des adresses introuvables.
+    La réponse CSV est lue ligne à ligne, au fil de l'eau.
+    """
+    base_url = "https://api-adresse.data.gouv.fr/search/csv/"
+    addresses = list(addresses)
+
+    for start in range(0, len(addresses), chunk_size):
+        chunk = addresses[start:start + chunk_size]
+        results = {}
+        for address in chunk:
+            cache_key = geocode_cache_key(address)
+            cached = geocode_cache.get(cache_key)
+            if cached is None:
+                cached = geocode_bulk_cache.get(cache_key)
+            if cached is not None:
+                results[address] = dict(cached)
+            elif geocode_negative_cache.get(cache_key) is not None:
+                results[address] = {"error": "Adresse introuvable"}
+        misses = list(dict.fromkeys(address for address in chunk if address not in results))
+
+        if misses:
+            payload = pd.DataFrame({"adresse": misses}).to_csv(index=False)
+            try:
+                with get_client().stream(
+                    "POST",
+                    base_url,
+                    files={"data": ("adresses.csv", payload, "text/csv")},
+                    data={"columns": "adresse"},
+                    # un gros fichier peut prendre plusieurs dizaines de secondes
+                    timeout=(3.05, 120)
+                ) as r:
+                    r.raise_for_status()
+                    r.encoding = r.encoding or "utf-8"
+                    rows = list(csv.DictReader(r.iter_lines(decode_unicode=True)))
+                if len(rows) != len(misses):
+                    raise ValueError(f"réponse BAN incomplète ({len(rows)} lignes pour {len(misses)} adresses)")
+                for address, row in zip(misses, rows):
+                    result = _parse_ban_csv_row(row)
+                    if "error" in result:
+                        geocode_negative_cache.set(geocode_cache_key(address), True)
+                    elif row.get("result_x") and row.get("result_y"):
+                        geocode_cache.set(geocode_cache_key(address), result)
+                    else:
+                        # x/y recalculés (à quelques centimètres près) : hors de geocode_cache,
+                        # qui sert aussi get_coordinates_from_address, dont les x/y sont exacts
+                        geocode_bulk_cache.set(geocode_cache_key(address), result)
+                    results[address] = result
+            except (requests.exceptions.RequestException, ValueError) as e:
+                for address in misses:
+                    results[address] = {"error": str(e)}
+
+        for address in chunk:
+            yield address, dict(results[address])
+
+def id_parcelle_dvf(properties):
+    """
+    Identifiant de parcelle au format DVF (14 caractères : code commune INSEE, préfixe de
+    section sur 3, section sur 2, numéro sur 4) construit depuis les propriétés d'une parcelle
+    de la géoplateforme, dont le champ "id" ne suit pas toujours ce format.
+    """
+    code_commune = properties.get("citycode") or (
+        f"{properties.get('departmentcode', '')}{properties.get('municipalitycode', '')}"
+    )
+    section, numero = properties.get("section"), properties.get("number")
+    if len(code_commune) != 5 or not section or not numero:
+        return properties.get("id")
+    prefixe = (properties.get("oldmunicipalitycode") or "000").zfill(3)
+    return f"{code_commune}{prefixe}{section.zfill(2)}{numero.zfill(4)}"
+
 def get_id_cadastre_from_coordinates(lon, lat, limit=3):
     """
-    Récupère l'id d'une parcelle à partir des long/lat via l'API géoplateforme.
+    Récupère les ids (format DVF) des parcelles sous les long/lat via l'API géoplateforme.
     """
     base_url = "https://data.geopf.fr/geocodage/reverse?"
     params = {
@@ -108,18 +621,19 @@ def get_id_cadastre_from_coordinates(lon, lat, limit=3):
     }
 
     try:
-        response = requests.get(base_url, params=params, timeout=5)
+        response = get_client().get(base_url, params=params)
         response.raise_for_status()
         data = response.json()
 
+        # aucune parcelle sous le point : résultat vide, pas une erreur de la source
         if not data.get("features"):
-            return {"error": "Id parcelle introuvable"}
+            return {"id_parcelles": []}
 
-        # Boucle sur toutes les parcelles trouvées
+        # Boucle sur toutes les parcelles trouvées, identifiants au format DVF
         parcelles = []
         for feature in data["features"]:
             properties = feature.get("properties", {})
-            parcelles.append(properties.get("id"))
+            parcelles.append(id_parcelle_dvf(properties))
 
         result = {
             "id_parcelles": parcelles
@@ -131,32 +645,94 @@ def get_id_cadastre_from_coordinates(lon, lat, limit=3):
     
     
 
-def get_dpe_exact_address(normalized_address: str, token: str, size: int = 10):
-    """
-    Récupère les DPE correspondant exactement à l'adresse via l'API ADEME
-    et retourne une chaîne JSON joliment formatée.
-    """
-    base_url = "https://data.ademe.fr/data-fair/api/v1/datasets/dpe03existant/lines"
+# API des DPE existants (ADEME, data-fair)
+DPE_API_URL = "https://data.ademe.fr/data-fair/api/v1/datasets/dpe03existant/lines"
 
-    normalized_address = normalized_address.upper()
+# Lignes demandées par page à l'API DPE : un immeuble tient en général dans une page,
+# les suivantes ne sont demandées que si l'on continue à lire
+DPE_PAGE_SIZE = 100
+
+# Écart toléré (mètres) entre le point BAN et les coordonnées d'un DPE
+DPE_COORD_TOLERANCE = 0.5
+
+# Champs de DPE_FIELDS demandés à l'API (ses clés n'ont pas d'espace ; le CSV renvoie les noms d'origine)
+DPE_SELECT = ",".join(field.replace(" ", "_") for field in DPE_FIELDS)
 
+def iter_dpe_pages(params: dict, token: str, max_rows=None, page_size: int = DPE_PAGE_SIZE, format: str = "csv"):
+    """
+    Parcourt les résultats de l'API DPE page par page, en suivant le lien "next"
+    (en-tête Link en CSV, champ "next" en JSON). Génère un DataFrame par page en CSV,
+    lu au fil de la réponse sans en garder le texte, ou la liste des lignes en JSON.
+    S'arrête après `max_rows` lignes ; un appelant qui cesse d'itérer ne déclenche
+    aucune autre requête.
+    """
     headers = {
         "Authorization": f"Bearer {token}"
     }
+    url = DPE_API_URL
+    params = {**params, "size": page_size if max_rows is None else min(page_size, max_rows), "format": format}
+    remaining = max_rows
+    while url and (remaining is None or remaining > 0):
+        # coupure pendant la lecture : RequestException, comme une erreur de requête
+        with get_client().stream("GET", url, headers=headers, params=params) as r:
+            r.raise_for_status()
+            if format == "csv":
+                r.raw.decode_content = True
+                try:
+                    page = pd.read_csv(r.raw)
+                except pd.errors.EmptyDataError:
+                    page = pd.DataFrame()
+                url = r.links.get("next", {}).get("url")
+            else:
+                data = r.json()
+                page, url = data.get("results", []), data.get("next")
+        # l'URL "next" porte déjà tous les paramètres
+        params = None
+        if remaining is not None:
+            page = page[:remaining]
+            remaining -= len(page)
+        if len(page) == 0:
+            return
+        yield page
+
+def get_dpe_local_address(normalized_address, size=None):
+    """
+    Cherche les DPE de l'adresse BAN dans l'index DPE local (tous, ou les `size` premiers),
+    lignes au format de l'API (clés sans espace). Renvoie None si l'index n'existe pas
+    ou ne connaît pas cette adresse.
+    """
+    dpe_store = get_dpe_store()
+    if dpe_store is None:
+        return None
+    positions = dpe_store.adresse_positions(normalize_address(normalized_address))
+    if len(positions) == 0:
+        return None
+    df = dpe_store.df.iloc[positions[:size]][DPE_FIELDS]
+    return json.loads(df.rename(columns=lambda field: field.replace(" ", "_")).to_json(orient="records"))
+
+def get_dpe_exact_address(normalized_address: str, token: str, size=None, local: bool = True):
+    """
+    Récupère les DPE correspondant exactement à l'adresse via l'API ADEME (toutes les pages,
+    ou les `size` premiers) et retourne une chaîne JSON joliment formatée.
+    Avec `local`, l'index DPE local est consulté d'abord (l'API sert de repli).
+    """
+    if local:
+        data = get_dpe_local_address(normalized_address, size)
+        if data is not None:
+            return json.dumps(data, indent=4, ensure_ascii=False)
+
+    normalized_address = normalized_address.upper()
 
     params = {
         "q": normalized_address,
         "select": "numero_dpe,adresse_ban,_geopoint,etiquette_dpe,date_etablissement_dpe,date_derniere_modification_dpe,etiquette_ges,conso_5_usages_par_m2_ef,conso_5_usages_par_m2_ep,emission_ges_5_usages_par_m2,annee_construction,type_batiment,nombre_niveau_logement,complement_adresse_logement,surface_habitable_logement,type_installation_chauffage",
         "sort": "date_derniere_modification_dpe",
-        "q_fields": "adresse_ban",
-        "size": size
+        "q_fields": "adresse_ban"
     }
 
 
     try:
-        r = requests.get(base_url, headers=headers, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json().get("results", [])
+        data = [row for page in iter_dpe_pages(params, token, max_rows=size, format="json") for row in page]
 
         # Retourner en JSON joli
         return json.dumps(data, indent=4, ensure_ascii=False)
@@ -165,38 +741,86 @@ def get_dpe_exact_address(normalized_address: str, token: str, size: int = 10):
         # Erreur en JSON joli
         return json.dumps({"error": str(e)}, indent=4, ensure_ascii=False)
 
-from io import StringIO
+# Cache des DPE par coordonnées BAN : durée de vie selon la fraîcheur des DPE trouvés (en secondes)
+DPE_CACHE_MIN_TTL = float(os.getenv("DPE_CACHE_MIN_TTL", 24 * 3600))
+DPE_CACHE_MAX_TTL = float(os.getenv("DPE_CACHE_MAX_TTL", 30 * 24 * 3600))
+# DataFrames sur disque : table plus petite que celle du géocodage
+dpe_cache = TieredCache("dpe_coordonnees", ttl=DPE_CACHE_MAX_TTL, maxsize=2_000, path=CACHE_PATH, disk_maxsize=20_000)
 
-def get_dpe_exact_coordinates(x, y, token: str, size: int = 10):
+def dpe_cache_ttl(df):
     """
-    Récupère les DPE correspondant exactement à l'adresse via l'API ADEME
-    et retourne un DataFrame pandas directement depuis le CSV.
+    Durée de vie en cache d'une réponse DPE : un DPE modifié récemment a plus de
+    chances de l'être encore, la réponse est alors gardée moins longtemps.
     """
-    base_url = "https://data.ademe.fr/data-fair/api/v1/datasets/dpe03existant/lines"
-
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-
+    if df.empty or 'date_derniere_modification_dpe' not in df.columns:
+        return DPE_CACHE_MIN_TTL
+    last_modification = pd.to_datetime(df['date_derniere_modification_dpe'], errors='coerce').max()
+    if pd.isna(last_modification):
+        return DPE_CACHE_MIN_TTL
+    age = (pd.Timestamp.now() - last_modification).total_seconds()
+    return min(max(age / 10, DPE_CACHE_MIN_TTL), DPE_CACHE_MAX_TTL)
+
+def get_dpe_local(x, y, size=None):
+    """
+    Cherche les DPE du point BAN (x, y) dans l'index DPE local (tous, ou les `size` premiers).
+    Renvoie None si l'index n'existe pas ou ne connaît pas ce point.
+    """
+    dpe_store = get_dpe_store()
+    if dpe_store is None:
+        return None
+    positions = dpe_store.coordinates_positions(x, y, DPE_COORD_TOLERANCE)
+    if len(positions) == 0:
+        return None
+    return dpe_store.df.iloc[positions[:size]][DPE_FIELDS].reset_index(drop=True)
+
+def get_dpe_exact_coordinates(x, y, token: str, size=None, local: bool = True):
+    """
+    Récupère les DPE du point BAN (x, y) via l'API ADEME, toutes les pages ou les `size`
+    premiers, et retourne un DataFrame pandas lu directement depuis le CSV (champs de DPE_FIELDS).
+    Avec `local`, l'index DPE local est consulté d'abord (l'API sert de repli).
+    Les DataFrames obtenus de l'API sont mis en cache par (x, y, size).
+    """
+    if local:
+        df = get_dpe_local(x, y, size)
+        if df is not None:
+            return df
+
+    cache_key = (x, y, size)
+    cached = dpe_cache.get(cache_key)
+    if cached is not None:
+        return cached.copy()
+
+    # carré de +/- DPE_COORD_TOLERANCE autour du point, comme l'index local : absorbe
+    # les x/y recalculés depuis longitude/latitude (géocodage en masse)
     params = {
         "sort": "date_derniere_modification_dpe",
-        "coordonnee_cartographique_x_ban_eq": x,
-        "coordonnee_cartographique_y_ban_eq": y,
-        "size": size,
-        "format": "csv"  # ✅ Demande le CSV directement
+        "coordonnee_cartographique_x_ban_gte": x - DPE_COORD_TOLERANCE,
+        "coordonnee_cartographique_x_ban_lte": x + DPE_COORD_TOLERANCE,
+        "coordonnee_cartographique_y_ban_gte": y - DPE_COORD_TOLERANCE,
+        "coordonnee_cartographique_y_ban_lte": y + DPE_COORD_TOLERANCE,
+        "select": DPE_SELECT
     }
 
     try:
-        r = requests.get(base_url, headers=headers, params=params, timeout=10)
-        r.raise_for_status()
-
-        # Charger directement le CSV dans un DataFrame
-        df = pd.read_csv(StringIO(r.text))
-        return df
+        pages = list(iter_dpe_pages(params, token, max_rows=size))
+        df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=DPE_FIELDS)
+        dpe_cache.set(cache_key, df, ttl=dpe_cache_ttl(df))
+        return df.copy()
 
     except requests.exceptions.RequestException as e:
         return pd.DataFrame([{"error": str(e)}])
     
     
+def filter_dvf_by_surface(df_dvf, surface, tolerance=0.05):
+    """
+    Garde les mutations DVF dont la surface bâtie est à +/- `tolerance` de `surface`.
+    """
+    min_surface = surface * (1 - tolerance)
+    max_surface = surface * (1 + tolerance)
+    return df_dvf[
+        (df_dvf['surface_reelle_bati'] >= min_surface) &
+        (df_dvf['surface_reelle_bati'] <= max_surface)
+    ]
+
 def highlight_used_fields(row, champs_utilises):
     return ['background-color: #e2d8f3' if row["champ à remplir"] in champs_utilises else '' for _ in row]
\ No newline at end of file